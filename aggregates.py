@@ -0,0 +1,453 @@
+import datetime
+import json
+import sqlite3
+import threading
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+from decimal import Decimal
+from functools import lru_cache
+
+from validation import parse_duration
+
+# Rowing ergometer splits are given per 500 metres.
+SPLIT_DISTANCE_KM = 0.5
+SPLIT_WORKSHEETS = ["Rowing Ergometer"]
+
+# How many of the most recent workouts each aggregate remembers,
+# i.e. the largest `last` it can answer stats queries for.
+RECENT_WORKOUTS = 10
+
+# Trend periods and the key each date is rolled up under. Keys sort
+# in date order: ISO weeks as 2023-W05 and months as 2023-01.
+PERIODS = {
+    "week": lambda date: "%04d-W%02d" % date.isocalendar()[:2],
+    "month": lambda date: f"{date.year:04d}-{date.month:02d}",
+}
+
+
+def row_seconds(duration):
+    """
+    Return a worksheet duration as whole seconds, or 0 if it can't be read.
+    Rows typed in before durations were validated may lack leading zeros.
+    """
+    seconds = parse_duration(duration)
+    if seconds is not None:
+        return seconds
+    parts = duration.split(":")
+    if len(parts) != 3 or not all(part.isdigit() for part in parts):
+        return 0
+    hours, minutes, seconds = (int(part) for part in parts)
+    return hours * 3600 + minutes * 60 + seconds
+
+
+@lru_cache(maxsize=None)
+def exact_km(hundredths):
+    """
+    Return a distance in hundredths of a km as a Decimal number of km.
+    WorkoutColumns keeps km as float32, which only holds 00.00
+    distances to within rounding, so totals are kept in Decimal.
+    """
+    return Decimal(hundredths).scaleb(-2)
+
+
+def row_date(date_text):
+    """
+    Return a dd-mm-yyyy worksheet date as a datetime.date, or None if it can't be read.
+    """
+    if len(date_text) != 10 or date_text[2] != "-" or date_text[5] != "-":
+        return None
+    day, month, year = date_text[:2], date_text[3:5], date_text[6:]
+    if not (day.isdigit() and month.isdigit() and year.isdigit()):
+        return None
+    try:
+        return datetime.date(int(year), int(month), int(day))
+    except ValueError:
+        return None
+
+
+def summarise(worksheet, count, total_seconds, total_km, paced_seconds,
+              all_time_count, all_time_total_seconds, all_time_total_km):
+    """
+    Build the dictionary returned by stats.workout_stats from the totals
+    of the window of recent workouts and of the whole worksheet.
+    paced_seconds only counts the window's workouts that have a distance,
+    so rows whose distance couldn't be read don't slow the pace.
+    """
+    pace = paced_seconds / total_km if total_km else None
+    return {
+        "worksheet": worksheet,
+        "count": count,
+        "total_seconds": total_seconds,
+        "total_km": round(total_km, 2),
+        "average_seconds": total_seconds / count if count else None,
+        "average_km": round(total_km / count, 2) if count else None,
+        "pace_seconds_per_km": pace,
+        "split_seconds_per_500m": pace * SPLIT_DISTANCE_KM if pace and worksheet in SPLIT_WORKSHEETS else None,
+        "all_time_count": all_time_count,
+        "all_time_total_seconds": all_time_total_seconds,
+        "all_time_total_km": round(all_time_total_km, 2),
+    }
+
+
+class Rollup:
+    """
+    Totals for each week or month, kept as parallel columns ordered by
+    period, so a trend over years of daily workouts is a few hundred
+    points. Adding a workout to the latest period takes constant time.
+    """
+
+    def __init__(self, periods=(), counts=(), seconds=(), km=(), best_paces=(), longest_km=()):
+        self.periods = list(periods)
+        self.counts = list(counts)
+        self.seconds = list(seconds)
+        self.km = list(km)
+        # Fastest pace in seconds per km, None until a workout has a distance.
+        self.best_paces = list(best_paces)
+        self.longest_km = list(longest_km)
+
+    def add(self, period, seconds, km, pace):
+        self.add_totals(period, 1, seconds, km, pace, km)
+
+    def add_totals(self, period, count, seconds, km, best_pace, longest_km):
+        """
+        Add the totals of count workouts to a period.
+        """
+        index = len(self.periods) - 1
+        if index < 0 or self.periods[index] != period:
+            # Workouts imported with older dates land in earlier periods.
+            index = bisect_left(self.periods, period)
+            if index == len(self.periods) or self.periods[index] != period:
+                self.periods.insert(index, period)
+                self.counts.insert(index, 0)
+                self.seconds.insert(index, 0)
+                self.km.insert(index, Decimal(0))
+                self.best_paces.insert(index, None)
+                self.longest_km.insert(index, Decimal(0))
+        self.counts[index] += count
+        self.seconds[index] += seconds
+        self.km[index] += km
+        if longest_km > self.longest_km[index]:
+            self.longest_km[index] = longest_km
+        if best_pace is not None and (self.best_paces[index] is None or best_pace < self.best_paces[index]):
+            self.best_paces[index] = best_pace
+
+    def merge(self, other):
+        """
+        Add every period of another Rollup to this one.
+        """
+        for row in other.rows():
+            self.add_totals(*row)
+
+    def points(self, since=None):
+        """
+        Return one dictionary per period, oldest first,
+        starting from the period key since if given.
+        """
+        start = bisect_left(self.periods, since) if since else 0
+        return [
+            {
+                "period": self.periods[index],
+                "count": self.counts[index],
+                "total_seconds": self.seconds[index],
+                "total_km": round(float(self.km[index]), 2),
+                "pace_seconds_per_km": self.seconds[index] / float(self.km[index]) if self.km[index] else None,
+                "best_pace_seconds_per_km": self.best_paces[index],
+                "longest_km": float(self.longest_km[index]),
+            }
+            for index in range(start, len(self.periods))
+        ]
+
+    def rows(self):
+        """
+        Yield (period, count, seconds, km, best pace, longest km) for each period.
+        """
+        return zip(self.periods, self.counts, self.seconds, self.km, self.best_paces, self.longest_km)
+
+    @classmethod
+    def from_rows(cls, rows):
+        rollup = cls()
+        for row in rows:
+            rollup.add_totals(*row)
+        return rollup
+
+
+class WorkoutAggregate:
+    """
+    Running totals of one worksheet plus its RECENT_WORKOUTS most recent
+    workouts, weekly and monthly Rollups and personal records, so stats
+    and trends never need the raw rows.
+    """
+
+    def __init__(self, count=0, total_seconds=0, total_km=Decimal(0), recent=(), rollups=None, records=None):
+        self.count = count
+        self.total_seconds = total_seconds
+        self.total_km = total_km
+        # (seconds, km) of the latest workouts, oldest first.
+        self.recent = deque(recent, maxlen=RECENT_WORKOUTS)
+        self.rollups = rollups or {period: Rollup() for period in PERIODS}
+        # Record name -> [value, date] of the best workout so far.
+        self.records = records or {}
+
+    @classmethod
+    def from_columns(cls, columns):
+        aggregate = cls()
+        aggregate.add_columns(columns)
+        return aggregate
+
+    def add_columns(self, columns):
+        """
+        Add parsed workouts.WorkoutColumns, oldest first.
+        """
+        # Consecutive workouts usually share a date, so its keys are reused.
+        ordinal = date_text = keys = None
+        for workout_ordinal, seconds, km in zip(columns.ordinals, columns.seconds, columns.km):
+            km = exact_km(round(km * 100))
+            self.count += 1
+            self.total_seconds += seconds
+            self.total_km += km
+            self.recent.append((seconds, km))
+            pace = seconds / float(km) if km else None
+            if workout_ordinal != ordinal:
+                ordinal = workout_ordinal
+                if ordinal:
+                    date = datetime.date.fromordinal(ordinal)
+                    date_text = date.strftime("%d-%m-%Y")
+                    keys = [(period, period_key(date)) for period, period_key in PERIODS.items()]
+                else:
+                    date_text = keys = None
+            if keys is not None:
+                for period, key in keys:
+                    self.rollups[period].add(key, seconds, km, pace)
+            self._update_records(date_text, seconds, km, pace)
+
+    def _update_records(self, date_text, seconds, km, pace):
+        if km > self.records.get("longest_km", (0,))[0]:
+            self.records["longest_km"] = [km, date_text]
+        if seconds > self.records.get("longest_seconds", (0,))[0]:
+            self.records["longest_seconds"] = [seconds, date_text]
+        if pace is not None:
+            fastest = self.records.get("fastest_pace")
+            if fastest is None or pace < fastest[0]:
+                self.records["fastest_pace"] = [pace, date_text]
+
+    def stats(self, worksheet, last=3):
+        """
+        Return the same dictionary as stats.workout_stats for the
+        `last` most recent workouts, where last <= RECENT_WORKOUTS.
+        """
+        window = list(self.recent)[len(self.recent) - min(last, len(self.recent)):]
+        return summarise(
+            worksheet,
+            len(window),
+            sum(seconds for seconds, _ in window),
+            float(sum((km for _, km in window), Decimal(0))),
+            sum(seconds for seconds, km in window if km),
+            self.count,
+            self.total_seconds,
+            float(self.total_km),
+        )
+
+    def trends(self, worksheet, period="month", since=None):
+        """
+        Return the worksheet's per-period totals, starting from the
+        period containing the date since if given, and its personal records.
+        """
+        since_key = PERIODS[period](since) if since else None
+        records = {
+            name: {"value": float(value), "date": date_text}
+            for name, (value, date_text) in self.records.items()
+        }
+        if "fastest_pace" in records and worksheet in SPLIT_WORKSHEETS:
+            records["fastest_split_500m"] = {
+                "value": records["fastest_pace"]["value"] * SPLIT_DISTANCE_KM,
+                "date": records["fastest_pace"]["date"],
+            }
+        return {
+            "worksheet": worksheet,
+            "period": period,
+            "points": self.rollups[period].points(since_key),
+            "records": records,
+        }
+
+    def to_json(self):
+        """
+        Everything but the rollups, which are stored a period at a time.
+        """
+        records = dict(self.records)
+        if "longest_km" in records:
+            records["longest_km"] = [str(records["longest_km"][0]), records["longest_km"][1]]
+        return {
+            "count": self.count,
+            "total_seconds": self.total_seconds,
+            "total_km": str(self.total_km),
+            "recent": [[seconds, str(km)] for seconds, km in self.recent],
+            "records": records,
+        }
+
+    @classmethod
+    def from_json(cls, data):
+        records = dict(data["records"])
+        if "longest_km" in records:
+            records["longest_km"] = [Decimal(records["longest_km"][0]), records["longest_km"][1]]
+        return cls(
+            data["count"],
+            data["total_seconds"],
+            Decimal(data["total_km"]),
+            [(seconds, Decimal(km)) for seconds, km in data["recent"]],
+            records=records,
+        )
+
+
+class AggregateStore:
+    """
+    SQLite tables of one WorkoutAggregate per (username, worksheet),
+    with its rollups kept a row per period in a table of their own.
+
+    Appending rows reads and rewrites only that worksheet's totals and
+    the rollup rows of the periods the new rows fall in, in a transaction
+    that holds SQLite's write lock, so processes sharing the file never
+    overwrite one another's updates. A worksheet's aggregate is only
+    created from its full history the first time its stats or trends
+    are asked for. Each worksheet also has a version that every append
+    in this process bumps, so an aggregate built from rows read while
+    another append was in progress is thrown away rather than saved
+    without that append.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS aggregates (
+            username TEXT NOT NULL,
+            worksheet TEXT NOT NULL,
+            aggregate TEXT NOT NULL,
+            PRIMARY KEY (username, worksheet)
+        );
+        CREATE TABLE IF NOT EXISTS rollups (
+            username TEXT NOT NULL,
+            worksheet TEXT NOT NULL,
+            period_type TEXT NOT NULL,
+            period TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            seconds INTEGER NOT NULL,
+            km TEXT NOT NULL,
+            best_pace REAL,
+            longest_km TEXT NOT NULL,
+            PRIMARY KEY (username, worksheet, period_type, period)
+        );
+    """
+
+    def __init__(self, path):
+        self.path = path
+        # Transactions are begun explicitly, with BEGIN IMMEDIATE.
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._versions = {}
+        self._lock = threading.Lock()
+        with self._lock:
+            if path != ":memory:":
+                self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.executescript(self.SCHEMA)
+
+    @contextmanager
+    def _transaction(self):
+        """
+        Hold this process's lock and SQLite's write lock until the block ends.
+        """
+        with self._lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+            self.connection.execute("COMMIT")
+
+    def _get(self, username, worksheet, periods=()):
+        """
+        Load a worksheet's aggregate with the rollups of the given
+        period types. Its other rollups are left empty.
+        """
+        row = self.connection.execute(
+            "SELECT aggregate FROM aggregates WHERE username = ? AND worksheet = ?", (username, worksheet)
+        ).fetchone()
+        if row is None:
+            return None
+        aggregate = WorkoutAggregate.from_json(json.loads(row[0]))
+        for period in periods:
+            aggregate.rollups[period] = self._load_rollup(username, worksheet, period)
+        return aggregate
+
+    def _load_rollup(self, username, worksheet, period, keys=None):
+        query = ("SELECT period, count, seconds, km, best_pace, longest_km FROM rollups "
+                 "WHERE username = ? AND worksheet = ? AND period_type = ?")
+        parameters = [username, worksheet, period]
+        if keys is not None:
+            query += f" AND period IN ({', '.join('?' * len(keys))})"
+            parameters.extend(keys)
+        rows = self.connection.execute(query + " ORDER BY period", parameters).fetchall()
+        return Rollup.from_rows(
+            (key, count, seconds, Decimal(km), best_pace, Decimal(longest_km))
+            for key, count, seconds, km, best_pace, longest_km in rows
+        )
+
+    def _put(self, username, worksheet, aggregate):
+        self.connection.execute(
+            "INSERT INTO aggregates (username, worksheet, aggregate) VALUES (?, ?, ?) "
+            "ON CONFLICT (username, worksheet) DO UPDATE SET aggregate = excluded.aggregate",
+            (username, worksheet, json.dumps(aggregate.to_json())),
+        )
+
+    def _put_rollup(self, username, worksheet, period, rollup):
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO rollups (username, worksheet, period_type, period, "
+            "count, seconds, km, best_pace, longest_km) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [(username, worksheet, period, key, count, seconds, str(km), best_pace, str(longest_km))
+             for key, count, seconds, km, best_pace, longest_km in rollup.rows()],
+        )
+
+    def version(self, username, worksheet):
+        with self._lock:
+            return self._versions.get((username, worksheet), 0)
+
+    def get(self, username, worksheet, periods=()):
+        """
+        Return a worksheet's WorkoutAggregate with the rollups of the
+        given period types, or None if it has no aggregate yet.
+        """
+        with self._lock:
+            return self._get(username, worksheet, periods)
+
+    def record(self, username, worksheet, columns):
+        """
+        Add workouts.WorkoutColumns that have just been appended to a worksheet.
+        """
+        key = (username, worksheet)
+        with self._transaction():
+            self._versions[key] = self._versions.get(key, 0) + 1
+            aggregate = self._get(username, worksheet)
+            if aggregate is None:
+                return
+            # The loaded aggregate has empty rollups, so afterwards
+            # they hold just the periods of the new rows.
+            aggregate.add_columns(columns)
+            self._put(username, worksheet, aggregate)
+            for period, added in aggregate.rollups.items():
+                if added.periods:
+                    rollup = self._load_rollup(username, worksheet, period, added.periods)
+                    rollup.merge(added)
+                    self._put_rollup(username, worksheet, period, rollup)
+
+    def seed(self, username, worksheet, aggregate, version):
+        """
+        Save an aggregate built from a worksheet's full history, replacing
+        any stored one, unless the worksheet has been appended to since
+        version() was read.
+        """
+        with self._transaction():
+            if self._versions.get((username, worksheet), 0) != version:
+                return
+            self._put(username, worksheet, aggregate)
+            self.connection.execute(
+                "DELETE FROM rollups WHERE username = ? AND worksheet = ?", (username, worksheet)
+            )
+            for period, rollup in aggregate.rollups.items():
+                self._put_rollup(username, worksheet, period, rollup)
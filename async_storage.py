@@ -0,0 +1,58 @@
+import asyncio
+
+from storage import WORKSHEET_NAMES
+
+
+class AsyncStorage:
+    """
+    Asyncio front end for a Storage backend.
+    gspread is blocking, so each call runs in a worker thread and a
+    semaphore keeps at most `concurrency` of them in flight at once.
+    Independent reads, such as the three worksheets of one user,
+    then take one round trip instead of three.
+    """
+
+    def __init__(self, storage, concurrency=8):
+        self.storage = storage
+        self.semaphore = asyncio.Semaphore(concurrency)
+
+    async def call(self, method_name, *args):
+        """
+        Run storage.method_name(*args) in a worker thread.
+        """
+        async with self.semaphore:
+            return await asyncio.to_thread(getattr(self.storage, method_name), *args)
+
+    async def get_workouts_frames(self, username, worksheets=WORKSHEET_NAMES):
+        """
+        Fetch several of a user's worksheets concurrently.
+        Returns a dictionary of worksheet name -> workouts frame.
+        """
+        frames = await asyncio.gather(*[
+            self.call("get_workouts_frame", username, worksheet) for worksheet in worksheets
+        ])
+        return dict(zip(worksheets, frames))
+
+    async def summary(self, username, last=3, days=None):
+        """
+        Return stats.workout_stats for every machine of one user.
+        """
+        from stats import workout_stats
+
+        if days is None:
+            # Storage can answer these from its running totals.
+            return list(await asyncio.gather(*[
+                self.call("get_workout_stats", username, worksheet, last) for worksheet in WORKSHEET_NAMES
+            ]))
+        frames = await self.get_workouts_frames(username)
+        return [workout_stats(frame, worksheet, last=last, days=days)
+                for worksheet, frame in frames.items()]
+
+
+def summarise_all_machines(storage, username, last=3, days=None, concurrency=8):
+    """
+    Blocking helper that runs AsyncStorage.summary in its own event loop.
+    """
+    async def run_summary():
+        return await AsyncStorage(storage, concurrency).summary(username, last, days)
+    return asyncio.run(run_summary())
@@ -0,0 +1,82 @@
+"""
+Time exporting every user's workouts to Parquet with export.sync,
+one worksheet read at a time and with several reads in flight, and
+an incremental sync after some users have logged another workout.
+
+Uses the fake Google Sheets client with simulated latency. Every
+request goes through SheetsStorage's request scheduler, with quotas
+raised so that throttling doesn't hide the cost of the export itself.
+
+Run from the project root with:
+    python -m benchmarks.export --users 200 --rows 100 --concurrency 16 --latency 0.01
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+DIRECTORY = tempfile.mkdtemp()
+for kind in ["READ", "WRITE", "DRIVE"]:
+    os.environ.setdefault(f"UT2_{kind}_QUOTA", "1000000000")
+
+from benchmarks.fakes import FakeClient, FakeWorksheet, Requests  # noqa: E402
+from export import export_workouts  # noqa: E402
+from storage import (CREDENTIALS_SPREADSHEET_NAME, WORKSHEET_HEADINGS, WORKSHEET_NAMES,  # noqa: E402
+                     SheetsStorage)
+
+
+def username(number):
+    return f"user{number:06d}"
+
+
+def build_storage(users, rows, latency, name):
+    requests = Requests(latency=latency)
+    client = FakeClient(requests, scheduled=True)
+    client.add_spreadsheet(CREDENTIALS_SPREADSHEET_NAME, [FakeWorksheet(
+        "Sheet1", requests, [["Username", "Password"]] + [[username(number), "x"] for number in range(users)]
+    )])
+    history = [[f"{1 + row % 28:02d}-{1 + row // 28 % 12:02d}-2023", "01:00:00", f"{10 + row % 10}.50"]
+               for row in range(rows)]
+    index = {}
+    for number in range(users):
+        workbook = client.add_spreadsheet(f"{username(number)} UT2 Tracker Spreadsheet", [
+            FakeWorksheet(worksheet, requests, [WORKSHEET_HEADINGS] + history) for worksheet in WORKSHEET_NAMES
+        ])
+        index[username(number)] = workbook.id
+    os.environ["UT2_SPREADSHEET_INDEX"] = os.path.join(DIRECTORY, f"{name}-ids.json")
+    with open(os.environ["UT2_SPREADSHEET_INDEX"], "w") as index_file:
+        json.dump(index, index_file)
+    return SheetsStorage(client=client), requests
+
+
+def measure(label, storage, requests, directory, concurrency):
+    requests.reset()
+    started = time.perf_counter()
+    users, workouts = export_workouts(storage, directory, concurrency=concurrency, progress=lambda message: None)
+    elapsed = time.perf_counter() - started
+    print(f"{label:<22} {users:>6} {workouts:>9} {elapsed:9.3f} {requests.total:>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--rows", type=int, default=100, help="workouts in each worksheet")
+    parser.add_argument("--concurrency", type=int, default=16, help="worksheet reads in flight")
+    parser.add_argument("--latency", type=float, default=0.01)
+    args = parser.parse_args()
+
+    print("sync                    users  workouts  total s  requests")
+    storage, requests = build_storage(args.users, args.rows, args.latency, "sequential")
+    measure("full, 1 read at a time", storage, requests, os.path.join(DIRECTORY, "sequential"), 1)
+
+    storage, requests = build_storage(args.users, args.rows, args.latency, "concurrent")
+    directory = os.path.join(DIRECTORY, "concurrent")
+    measure(f"full, {args.concurrency} at a time", storage, requests, directory, args.concurrency)
+    for number in range(0, args.users, 10):
+        storage.append_workout(username(number), WORKSHEET_NAMES[number % 3], ["02-01-2024", "00:45:00", "09.75"])
+    measure("incremental", storage, requests, directory, args.concurrency)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,331 @@
+"""
+In-memory stand-ins for the parts of gspread and the Drive API used by
+storage.py. Every method that would be an HTTP request to Google calls
+Requests.make(), which counts it, sleeps for the configured latency and
+can fail with a rate limit error at a configured rate.
+
+By default requests are simulated directly. A FakeClient created with
+scheduled=True instead sends them through its request() method, the way
+gspread does, so SheetsStorage's request scheduler throttles them and
+retries the injected rate limit errors.
+"""
+import random
+import re
+import threading
+import time
+from collections import Counter
+from types import SimpleNamespace
+
+# Endpoint prefix that makes the request scheduler treat a request as Drive.
+DRIVE_ENDPOINT = "https://www.googleapis.com/drive/v3/files"
+# Prefix of spreadsheet endpoints, which the scheduler reads the spreadsheet id from.
+SHEETS_ENDPOINT = "https://sheets.googleapis.com/v4/spreadsheets"
+
+
+class FakeAPIError(Exception):
+    """
+    Error carrying an HTTP status like gspread's APIError,
+    so scheduler.error_status() can read it.
+    """
+
+    def __init__(self, status):
+        super().__init__(f"HTTP {status}")
+        self.response = SimpleNamespace(status_code=status)
+
+
+class Requests:
+    """
+    Counts simulated API requests by name and adds latency to each one.
+    With error_rate set, that share of requests fails with HTTP 429.
+    """
+
+    def __init__(self, latency=0.0, error_rate=0.0, seed=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.counts = Counter()
+        self.errors = Counter()
+        self.transport = None
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def make(self, name, method="GET", resource=""):
+        """
+        Make one request, through the transport client if there is one.
+        """
+        if self.transport is not None:
+            return self.transport.request(method, f"{resource}/{name}", name=name)
+        return self.simulate(name)
+
+    def simulate(self, name):
+        with self._lock:
+            self.counts[name] += 1
+            failed = self.error_rate and self._random.random() < self.error_rate
+            if failed:
+                self.errors[name] += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if failed:
+            raise FakeAPIError(429)
+
+    @property
+    def total(self):
+        return sum(self.counts.values())
+
+    def reset(self):
+        with self._lock:
+            self.counts.clear()
+            self.errors.clear()
+
+
+def cols_slice(range_name):
+    """
+    Column slice for an A1 range with single-letter columns.
+    """
+    letters = re.findall(r"[A-Z]", range_name.split("!")[-1])
+    return slice(ord(letters[0]) - ord("A"), ord(letters[-1]) - ord("A") + 1)
+
+
+def rows_slice(range_name):
+    """
+    Row slice for an A1 range, covering every row if none are given.
+    """
+    numbers = [int(number) for number in re.findall(r"\d+", range_name.split("!")[-1])]
+    if not numbers:
+        return slice(None)
+    return slice(numbers[0] - 1, numbers[-1])
+
+
+class FakeCell:
+    def __init__(self, row, col, value):
+        self.row = row
+        self.col = col
+        self.value = value
+
+
+class FakeWorksheet:
+    """
+    A worksheet holding its values as a list of rows of strings.
+    """
+
+    def __init__(self, title, requests, rows=None):
+        self.title = title
+        self.requests = requests
+        self.rows = [list(row) for row in rows or []]
+        # Set by the spreadsheet holding the worksheet.
+        self.spreadsheet_id = ""
+        self._lock = threading.Lock()
+
+    @property
+    def endpoint(self):
+        """
+        Shaped like Google's endpoints and unique to the worksheet, so the
+        scheduler never coalesces reads of different users' worksheets
+        and knows which spreadsheet each write changes.
+        """
+        return f"{SHEETS_ENDPOINT}/{self.spreadsheet_id}/values/{self.title}"
+
+    def get_all_values(self):
+        self.requests.make("get_all_values", resource=self.endpoint)
+        with self._lock:
+            return [list(row) for row in self.rows]
+
+    def get(self, range_name):
+        # Supports single-letter column ranges such as 'A:B', 'A2:C10' or 'B4'.
+        self.requests.make("get", resource=f"{self.endpoint}!{range_name}")
+        with self._lock:
+            return [row[cols] for row in self.rows[rows_slice(range_name)]
+                    for cols in [cols_slice(range_name)]]
+
+    def col_values(self, col):
+        self.requests.make("col_values", resource=f"{self.endpoint}!{col}")
+        with self._lock:
+            return [row[col - 1] for row in self.rows if len(row) >= col]
+
+    def find(self, query):
+        self.requests.make("find", resource=f"{self.endpoint}!{query}")
+        with self._lock:
+            for row_number, row in enumerate(self.rows, start=1):
+                for col_number, value in enumerate(row, start=1):
+                    if value == query:
+                        return FakeCell(row_number, col_number, value)
+        return None
+
+    def cell(self, row, col):
+        self.requests.make("cell", resource=f"{self.endpoint}!{row},{col}")
+        with self._lock:
+            values = self.rows[row - 1]
+            return FakeCell(row, col, values[col - 1] if len(values) >= col else None)
+
+    def insert_row(self, values, index=1):
+        self.requests.make("insert_row", "POST", self.endpoint)
+        with self._lock:
+            self.rows.insert(index - 1, list(values))
+
+    def append_row(self, values, **kwargs):
+        self.requests.make("append_row", "POST", self.endpoint)
+        with self._lock:
+            self.rows.append(list(values))
+            row_number = len(self.rows)
+        last_col = chr(ord("A") + len(values) - 1)
+        return {"updates": {"updatedRange": f"{self.title}!A{row_number}:{last_col}{row_number}"}}
+
+    def append_rows(self, values, **kwargs):
+        self.requests.make("append_rows", "POST", self.endpoint)
+        with self._lock:
+            self.rows.extend(list(row) for row in values)
+
+    def update(self, range_name, values):
+        # Supports single-letter column ranges starting at one cell, such as 'B4'.
+        self.requests.make("update", "PUT", f"{self.endpoint}!{range_name}")
+        first_row = rows_slice(range_name).start
+        first_col = cols_slice(range_name).start
+        with self._lock:
+            for row_index, row_values in enumerate(values, start=first_row):
+                while len(self.rows) <= row_index:
+                    self.rows.append([])
+                row = self.rows[row_index]
+                for col_index, value in enumerate(row_values, start=first_col):
+                    row.extend([""] * (col_index + 1 - len(row)))
+                    row[col_index] = value
+
+    def batch_clear(self, ranges):
+        self.requests.make("batch_clear", "POST", self.endpoint)
+        with self._lock:
+            for range_name in ranges:
+                cols = cols_slice(range_name)
+                for row in self.rows[rows_slice(range_name)]:
+                    for index in range(len(row))[cols]:
+                        row[index] = ""
+
+
+class FakeSpreadsheet:
+    def __init__(self, title, requests, worksheets=None, spreadsheet_id=None):
+        self.title = title
+        self.id = spreadsheet_id or f"id-{title}"
+        self.requests = requests
+        self._worksheets = worksheets or [FakeWorksheet("Sheet1", requests)]
+        for worksheet in self._worksheets:
+            worksheet.spreadsheet_id = self.id
+        self.shared_with = []
+
+    @property
+    def sheet1(self):
+        return self._worksheets[0]
+
+    def worksheet(self, title):
+        self.requests.make("worksheet", resource=f"{self.title}!{title}")
+        for worksheet in self._worksheets:
+            if worksheet.title == title:
+                return worksheet
+        raise KeyError(title)
+
+    def batch_update(self, body):
+        """
+        Apply the renames, added sheets and cell values
+        from storage.workbook_layout_requests().
+        """
+        self.requests.make("batch_update", "POST", self.title)
+        for request in body["requests"]:
+            if "updateSheetProperties" in request:
+                properties = request["updateSheetProperties"]["properties"]
+                self._worksheets[properties["sheetId"]].title = properties["title"]
+            elif "addSheet" in request:
+                title = request["addSheet"]["properties"]["title"]
+                worksheet = FakeWorksheet(title, self.requests)
+                worksheet.spreadsheet_id = self.id
+                self._worksheets.append(worksheet)
+            elif "updateCells" in request:
+                update = request["updateCells"]
+                worksheet = self._worksheets[update["start"]["sheetId"]]
+                worksheet.rows = [[value["userEnteredValue"]["stringValue"] for value in row["values"]]
+                                  for row in update["rows"]]
+        return {"replies": []}
+
+    def share(self, email_address, perm_type, role):
+        self.requests.make("share", "POST", f"{DRIVE_ENDPOINT}/{self.id}/permissions")
+        self.shared_with.append((email_address, perm_type, role))
+
+
+class FakeDriveRequest:
+    def __init__(self, requests, response):
+        self.requests = requests
+        self.response = response
+
+    def execute(self):
+        # SheetsStorage already sends execute() through its scheduler.
+        self.requests.simulate("files.list")
+        return self.response
+
+
+class FakeDriveFiles:
+    def __init__(self, client):
+        self.client = client
+
+    def list(self, q, spaces=None, fields=None, pageToken=None):
+        # Only the name='...' queries storage.py makes are supported.
+        name = re.fullmatch(r"name='(.*)'", q).group(1)
+        spreadsheet = self.client.spreadsheets.get(name)
+        files = [{"id": spreadsheet.id, "name": name}] if spreadsheet else []
+        return FakeDriveRequest(self.client.requests, {"files": files})
+
+
+class FakeDriveService:
+    """
+    The files().list() part of the Drive API client,
+    searching the spreadsheets of a FakeClient.
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    def files(self):
+        return FakeDriveFiles(self.client)
+
+
+class FakeClient:
+    """
+    A gspread client whose spreadsheets are kept in a dictionary by title.
+    With scheduled=True it has a request() method that every simulated
+    request goes through, which SheetsStorage wraps with its scheduler.
+    """
+
+    def __init__(self, requests=None, scheduled=False):
+        self.requests = requests or Requests()
+        self.spreadsheets = {}
+        self._by_id = {}
+        self._lock = threading.Lock()
+        if scheduled:
+            self.requests.transport = self
+            self.request = self._request
+
+    def _request(self, method, endpoint, name):
+        return self.requests.simulate(name)
+
+    def open(self, title):
+        self.requests.make("open", resource=f"{DRIVE_ENDPOINT}?q={title}")
+        return self.spreadsheets[title]
+
+    def open_by_key(self, key):
+        self.requests.make("open_by_key", resource=f"{SHEETS_ENDPOINT}/{key}")
+        return self._by_id[key]
+
+    def create(self, title):
+        self.requests.make("create", "POST", DRIVE_ENDPOINT)
+        return self.add_spreadsheet(title, [FakeWorksheet("Sheet1", self.requests)])
+
+    def copy(self, file_id, title=None):
+        self.requests.make("copy", "POST", f"{DRIVE_ENDPOINT}/{file_id}/copy")
+        template = self.open_by_key(file_id)
+        return self.add_spreadsheet(title, [
+            FakeWorksheet(worksheet.title, self.requests, worksheet.rows) for worksheet in template._worksheets
+        ])
+
+    def add_spreadsheet(self, title, worksheets):
+        """
+        Set up a spreadsheet without counting any requests.
+        """
+        with self._lock:
+            spreadsheet = FakeSpreadsheet(title, self.requests, worksheets, f"id-{len(self._by_id)}")
+            self.spreadsheets[title] = spreadsheet
+            self._by_id[spreadsheet.id] = spreadsheet
+        return spreadsheet
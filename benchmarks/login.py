@@ -0,0 +1,74 @@
+"""
+Compare the number of Google Sheets requests and the wall time
+of logging in with the old three-request lookup (col_values, find, cell)
+against SheetsStorage's single cached range read.
+
+Run from the project root with:
+    python -m benchmarks.login --users 1000 --latency 0.05
+"""
+import argparse
+import time
+
+from benchmarks.fakes import FakeClient, FakeWorksheet, Requests
+from storage import CREDENTIALS_SPREADSHEET_NAME, SheetsStorage
+
+
+def legacy_login(worksheet, username, password):
+    """
+    The lookup run.py used to do: search_username then check_password.
+    """
+    if username not in worksheet.col_values(1):
+        return False
+    cell = worksheet.find(username)
+    return worksheet.cell(cell.row, 2).value == password
+
+
+def storage_login(storage, username, password):
+    if not storage.username_exists(username):
+        return False
+    return storage.get_password(username) == password
+
+
+def measure(name, login, requests, logins):
+    requests.reset()
+    started = time.perf_counter()
+    for username, password in logins:
+        assert login(username, password)
+    elapsed = time.perf_counter() - started
+    per_login = requests.total / len(logins)
+    print(f"{name:<8} {per_login:5.2f} requests/login {elapsed / len(logins) * 1000:8.3f} ms/login")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--logins", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="simulated seconds per Google API request")
+    args = parser.parse_args()
+
+    requests = Requests(latency=args.latency)
+    client = FakeClient(requests)
+    rows = [[f"user{number:06d}", f"password{number}"] for number in range(args.users)]
+    worksheet = FakeWorksheet("Sheet1", requests, [["Username", "Password"]] + rows)
+    client.add_spreadsheet(CREDENTIALS_SPREADSHEET_NAME, [worksheet])
+    step = max(1, args.users // args.logins)
+    logins = [tuple(row) for row in rows[::step]][:args.logins]
+
+    measure("legacy", lambda u, p: legacy_login(worksheet, u, p), requests, logins)
+
+    # Opening the credentials spreadsheet is a one-off cost per process.
+    storage = SheetsStorage(client=client)
+    storage.credentials_sheet
+
+    # Invalidating before each login means every login starts with a cold cache.
+    def cold_login(username, password):
+        storage.credentials_index.invalidate()
+        return storage_login(storage, username, password)
+    measure("cold", cold_login, requests, logins)
+
+    measure("cached", lambda u, p: storage_login(storage, u, p), requests, logins)
+
+
+if __name__ == "__main__":
+    main()
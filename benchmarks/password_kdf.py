@@ -0,0 +1,51 @@
+"""
+Report login latency and throughput for each password hashing cost.
+
+For every cost, a batch of logins is checked by a pool of threads, as
+if that many athletes were logging in at the same moment. Use it to pick
+the highest UT2_PASSWORD_COST whose latency is acceptable at peak load.
+
+Run from the project root with:
+    python -m benchmarks.password_kdf --costs 12 13 14 15 --concurrency 1 8
+"""
+import argparse
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from passwords import hash_password, verify_password
+
+
+def measure(cost, concurrency, logins):
+    stored = hash_password("secretpassword", cost)
+
+    def login(_):
+        started = time.perf_counter()
+        matches, _ = verify_password("secretpassword", stored)
+        assert matches
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        latencies = sorted(executor.map(login, range(logins)))
+    elapsed = time.perf_counter() - started
+    p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+    print(f"{cost:>4} {concurrency:>11} {statistics.median(latencies) * 1000:10.1f} "
+          f"{p95 * 1000:9.1f} {logins / elapsed:12.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--costs", type=int, nargs="+", default=[12, 13, 14, 15])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8])
+    parser.add_argument("--logins", type=int, default=32, help="logins per measurement")
+    args = parser.parse_args()
+
+    print("cost concurrency  median ms    p95 ms  logins/sec")
+    for cost in args.costs:
+        for concurrency in args.concurrency:
+            measure(cost, concurrency, args.logins)
+
+
+if __name__ == "__main__":
+    main()
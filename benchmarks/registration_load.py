@@ -0,0 +1,65 @@
+"""
+Register many users in parallel against an in-memory credentials sheet.
+
+Every attempt gets its own SheetsStorage, like separate run.py processes,
+which has already checked the username is free, as register_new_user does.
+Each username is then registered by several threads at once, and the
+benchmark checks that every username ends up registered exactly once.
+
+Run from the project root with:
+    python -m benchmarks.registration_load --users 500 --threads 16
+"""
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.fakes import FakeClient, FakeWorksheet, Requests
+from storage import CREDENTIALS_SPREADSHEET_NAME, SheetsStorage
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--existing", type=int, default=1000,
+                        help="users already in the sheet")
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--duplicates", type=int, default=4,
+                        help="how many threads try to register each username")
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--latency", type=float, default=0.005,
+                        help="simulated seconds per Google API request")
+    args = parser.parse_args()
+
+    requests = Requests(latency=args.latency)
+    client = FakeClient(requests)
+    existing = [[f"existing{number:06d}", "password"] for number in range(args.existing)]
+    worksheet = FakeWorksheet("Sheet1", requests, [["Username", "Password"]] + existing)
+    client.add_spreadsheet(CREDENTIALS_SPREADSHEET_NAME, [worksheet])
+    attempts = [f"newuser{number:06d}" for number in range(args.users)] * args.duplicates
+
+    storages = []
+    for username in attempts:
+        storage = SheetsStorage(client=client)
+        assert not storage.username_exists(username)
+        storages.append(storage)
+
+    def register(attempt):
+        username, storage = attempt
+        return storage.add_user(username, "password")
+
+    requests.reset()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(args.threads) as executor:
+        results = list(executor.map(register, zip(attempts, storages)))
+    elapsed = time.perf_counter() - started
+
+    registered = [row[0] for row in worksheet.rows if len(row) > 1 and row[1]]
+    new_users = [username for username in registered if username.startswith("newuser")]
+    print(f"attempts: {len(attempts)} succeeded: {sum(results)} in {elapsed:.2f} s")
+    print(f"requests per attempt: {requests.total / len(attempts):.2f} {dict(requests.counts)}")
+    print(f"usernames registered once: {len(set(new_users))}/{args.users}")
+    assert sum(results) == args.users
+    assert len(new_users) == len(set(new_users)) == args.users
+
+
+if __name__ == "__main__":
+    main()
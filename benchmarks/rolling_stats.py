@@ -0,0 +1,68 @@
+"""
+Compare the cost of "log a workout, then show the averages" with and
+without the running totals kept by aggregates.AggregateStore.
+
+Without them, each stats query builds a DataFrame of the whole history
+from the cached WorkoutColumns. With them, only the first query reads
+the worksheet and later ones only touch the running totals. Uses the fake Google Sheets client
+with simulated latency and histories of several lengths.
+
+Run from the project root with:
+    python -m benchmarks.rolling_stats --rows 100 10000 100000 --sessions 20
+"""
+import argparse
+import os
+import tempfile
+import time
+
+# Keep the benchmark's files out of the real ones.
+DIRECTORY = tempfile.mkdtemp()
+os.environ["UT2_SPREADSHEET_INDEX"] = os.path.join(DIRECTORY, "spreadsheet_ids.json")
+
+from aggregates import AggregateStore  # noqa: E402
+from benchmarks.fakes import FakeClient, FakeWorksheet, Requests  # noqa: E402
+from storage import WORKSHEET_HEADINGS, WORKSHEET_NAMES, SheetsStorage  # noqa: E402
+
+WORKSHEET = "Rowing Ergometer"
+
+
+def build_storage(rows, latency, aggregates):
+    requests = Requests(latency=latency)
+    client = FakeClient(requests)
+    history = [["01-01-2023", "01:00:00", f"{10 + row % 10}.50"] for row in range(rows)]
+    client.add_spreadsheet("someuser UT2 Tracker Spreadsheet", [
+        FakeWorksheet(name, requests, [WORKSHEET_HEADINGS] + (history if name == WORKSHEET else []))
+        for name in WORKSHEET_NAMES
+    ])
+    return SheetsStorage(client=client, aggregates=aggregates), requests
+
+
+def measure(label, storage, requests, sessions):
+    started = time.perf_counter()
+    for _ in range(sessions):
+        storage.append_workout("someuser", WORKSHEET, ["02-01-2023", "00:30:00", "07.25"])
+        storage.get_workout_stats("someuser", WORKSHEET, last=3)
+    elapsed = time.perf_counter() - started
+    print(f"{label:<12} {elapsed * 1000 / sessions:14.1f} {requests.total / sessions:14.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, nargs="+", default=[100, 10_000, 100_000])
+    parser.add_argument("--sessions", type=int, default=20, help="workouts logged, each followed by stats")
+    parser.add_argument("--latency", type=float, default=0.05)
+    args = parser.parse_args()
+
+    for rows in args.rows:
+        print(f"{rows} workouts of history")
+        print("stats        ms per session  requests each")
+        storage, requests = build_storage(rows, args.latency, None)
+        measure("recomputed", storage, requests, args.sessions)
+        aggregates = AggregateStore(os.path.join(DIRECTORY, f"aggregates-{rows}.json"))
+        storage, requests = build_storage(rows, args.latency, aggregates)
+        measure("running", storage, requests, args.sessions)
+        print()
+
+
+if __name__ == "__main__":
+    main()
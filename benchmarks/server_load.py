@@ -0,0 +1,127 @@
+"""
+Simulate many athletes using one server.py process at the same time.
+
+Starts the server in this process on a free port, with either an
+in-memory SQLite database or a fake Google Sheets client with simulated
+latency. Each simulated user registers, logs in, logs some workouts and
+views their history and stats. Reports requests per second and latency
+percentiles for each kind of request.
+
+Run from the project root with:
+    python -m benchmarks.server_load --users 50 --workouts 5 --backend sheets --latency 0.05
+"""
+import argparse
+import json
+import os
+import string
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+os.environ["UT2_SPREADSHEET_INDEX"] = os.path.join(tempfile.mkdtemp(), "spreadsheet_ids.json")
+# Keep hashing cheap so the benchmark measures the server, not scrypt.
+os.environ.setdefault("UT2_PASSWORD_COST", "10")
+
+from benchmarks.fakes import FakeClient, FakeWorksheet, Requests  # noqa: E402
+from server import UT2Server  # noqa: E402
+from storage import CREDENTIALS_SPREADSHEET_NAME, SQLiteStorage, SheetsStorage  # noqa: E402
+
+
+def username_for(number):
+    letters = ""
+    number += 26 ** 4
+    while number:
+        number, remainder = divmod(number, 26)
+        letters += string.ascii_lowercase[remainder]
+    return "athlete" + letters
+
+
+class Client:
+    def __init__(self, base_url, timings):
+        self.base_url = base_url
+        self.timings = timings
+        self.token = None
+
+    def call(self, name, method, path, body=None):
+        headers = {"Content-Type": "application/json"}
+        if self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+        data = json.dumps(body).encode() if body is not None else None
+        request = urllib.request.Request(self.base_url + path, data=data, headers=headers, method=method)
+        started = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request) as response:
+                result = json.loads(response.read())
+        except urllib.error.HTTPError as error:
+            result = json.loads(error.read())
+        self.timings[name].append(time.perf_counter() - started)
+        if not result.get("ok"):
+            raise RuntimeError(f"{name} failed: {result}")
+        return result
+
+
+def simulate_user(base_url, number, workouts, timings):
+    client = Client(base_url, timings)
+    username = username_for(number)
+    client.call("register", "POST", "/register", {"username": username, "password": "secret"})
+    client.token = client.call("login", "POST", "/login", {"username": username, "password": "secret"})["token"]
+    for workout in range(workouts):
+        client.call("log", "POST", "/workouts",
+                    {"machine": "Rowing Ergometer", "duration": "01:00:00", "distance": f"1{workout % 10}.50"})
+    client.call("history", "GET", "/workouts?machine=Rowing%20Ergometer&count=20")
+    client.call("stats", "GET", "/stats?machine=Rowing%20Ergometer")
+
+
+def fake_sheets_storage(latency):
+    requests = Requests(latency=latency)
+    client = FakeClient(requests)
+    client.add_spreadsheet(CREDENTIALS_SPREADSHEET_NAME, [FakeWorksheet("Sheet1", requests, [["Username", "Password"]])])
+    return SheetsStorage(client=client), requests
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--workouts", type=int, default=5, help="workouts logged per user")
+    parser.add_argument("--workers", type=int, default=32, help="server worker threads")
+    parser.add_argument("--backend", choices=["sqlite", "sheets"], default="sqlite")
+    parser.add_argument("--latency", type=float, default=0.05,
+                        help="simulated seconds per Google API request (sheets backend)")
+    args = parser.parse_args()
+
+    requests = None
+    if args.backend == "sqlite":
+        storage = SQLiteStorage(":memory:")
+    else:
+        storage, requests = fake_sheets_storage(args.latency)
+    server = UT2Server(("127.0.0.1", 0), storage, args.workers)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    timings = defaultdict(list)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(args.users) as executor:
+        for future in [executor.submit(simulate_user, base_url, number, args.workouts, timings)
+                       for number in range(args.users)]:
+            future.result()
+    elapsed = time.perf_counter() - started
+    server.shutdown()
+    server.server_close()
+
+    total = sum(len(times) for times in timings.values())
+    print(f"{args.users} users, {total} requests in {elapsed:.2f} s ({total / elapsed:.0f} requests/s)")
+    print("request    count  median ms     p95 ms")
+    for name, times in timings.items():
+        times.sort()
+        print(f"{name:<9} {len(times):>6} {times[len(times) // 2] * 1000:10.1f} "
+              f"{times[int(len(times) * 0.95)] * 1000:10.1f}")
+    if requests is not None:
+        print(f"Google API requests: {requests.total}")
+
+
+if __name__ == "__main__":
+    main()
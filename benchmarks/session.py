@@ -0,0 +1,79 @@
+"""
+Time a scripted end-to-end session in each text rendering mode.
+
+The session registers a new user and logs their first rowing ergometer
+workout, answering every prompt from a script, against an in-memory
+SQLite database. Output is discarded, so the times show how much of a
+session is spent in print_incrementally rather than in real work.
+
+Run from the project root with:
+    python -m benchmarks.session --runs 3
+"""
+import argparse
+import builtins
+import contextlib
+import io
+import os
+import statistics
+import string
+import sys
+import time
+
+os.environ["UT2_STORAGE_BACKEND"] = "sqlite"
+os.environ["UT2_SQLITE_PATH"] = ":memory:"
+
+import run  # noqa: E402
+
+
+def scripted_username(number):
+    """
+    A valid, unique username: lowercase letters only.
+    """
+    letters = ""
+    number += 26 ** 4
+    while number:
+        number, remainder = divmod(number, 26)
+        letters += string.ascii_lowercase[remainder]
+    return "bench" + letters
+
+
+def run_session(number):
+    answers = iter([
+        "1",                        # new user
+        scripted_username(number),  # username
+        "secret",                   # password
+        "2",                        # rowing ergometer
+        "01:00:00",                 # duration
+        "12.50",                    # distance
+    ])
+    original_input = builtins.input
+    builtins.input = lambda prompt="": next(answers)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            run.new_user_or_existing_user()
+    finally:
+        builtins.input = original_input
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--modes", nargs="+", default=["animated", "buffered", "instant"])
+    args = parser.parse_args()
+
+    # Pretend to be a terminal so every mode is really used.
+    sys.stdin.isatty = lambda: True
+    number = 0
+    for mode in args.modes:
+        run.TEXT_MODE = mode
+        times = []
+        for _ in range(args.runs):
+            number += 1
+            started = time.perf_counter()
+            run_session(number)
+            times.append(time.perf_counter() - started)
+        print(f"{mode:<9} median {statistics.median(times):8.3f} s per session")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Measure cold start time of run.py.
+
+Starts a fresh Python process running run.py and records how long it
+takes for the banner (first output) and the first prompt to appear.
+No input is ever sent, so the program never reaches storage.
+
+Run from the project root with:
+    python -m benchmarks.startup --runs 10
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+FIRST_PROMPT = "Type 1 if you are a new user"
+
+
+def time_cold_start(env):
+    """
+    Return (seconds to first output, seconds to first prompt)
+    for one fresh run.py process.
+    """
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "run.py"],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        env=env,
+    )
+    first_output = None
+    output = b""
+    try:
+        while True:
+            chunk = os.read(process.stdout.fileno(), 4096)
+            if not chunk:
+                raise RuntimeError("run.py exited before the first prompt:\n" + output.decode(errors="replace"))
+            if first_output is None:
+                first_output = time.perf_counter() - started
+            output += chunk
+            if FIRST_PROMPT.encode() in output:
+                return first_output, time.perf_counter() - started
+    finally:
+        process.kill()
+        process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--backend", default="sheets", choices=["sheets", "sqlite"])
+    args = parser.parse_args()
+
+    env = dict(os.environ, UT2_STORAGE_BACKEND=args.backend, PYTHONUNBUFFERED="1")
+    first_outputs = []
+    first_prompts = []
+    for _ in range(args.runs):
+        first_output, first_prompt = time_cold_start(env)
+        first_outputs.append(first_output)
+        first_prompts.append(first_prompt)
+
+    print(f"runs: {args.runs} backend: {args.backend}")
+    print(f"first output  median {statistics.median(first_outputs) * 1000:8.1f} ms")
+    print(f"first prompt  median {statistics.median(first_prompts) * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+"""
+Offline benchmark suite for the main user journeys, run against the
+in-memory fake Google Sheets and Drive backend in benchmarks.fakes.
+
+Each scenario makes a fixed number of operations against a backend that
+already holds `size` registered users, workbooks and rows of history,
+so the table shows how the cost of one operation grows with the data:
+
+    registration  check a new username is free and add it
+    provisioning  search Drive for a new user's workbook and create it
+    login         check an existing user's password
+    logging       append a workout to a long history
+    history       fetch a page of 20 workouts from a long history
+    averages      stats for the last three workouts; "first" includes
+                  building the running totals from the whole history
+    trends        monthly totals and personal records, from the rollups
+                  kept with the running totals
+
+Requests go through SheetsStorage's request scheduler, so injected rate
+limit errors are retried as they would be against Google. Quotas are
+raised so that throttling doesn't hide the cost of the code itself.
+
+Run from the project root with:
+    python -m benchmarks.suite --sizes 10 1000 100000 --ops 20 --latency 0.01 --error-rate 0.02
+
+The same scenarios run as pytest-benchmark tests in tests/test_benchmarks.py.
+"""
+import argparse
+import datetime
+import json
+import os
+import tempfile
+import time
+
+DIRECTORY = tempfile.mkdtemp()
+os.environ.setdefault("UT2_PASSWORD_COST", "10")
+for kind in ["READ", "WRITE", "DRIVE"]:
+    os.environ.setdefault(f"UT2_{kind}_QUOTA", "1000000000")
+
+from aggregates import AggregateStore  # noqa: E402
+from benchmarks.fakes import FakeClient, FakeDriveService, FakeWorksheet, Requests  # noqa: E402
+from passwords import authenticate, hash_password  # noqa: E402
+from scheduler import RequestFailed  # noqa: E402
+from storage import (CREDENTIALS_SPREADSHEET_NAME, WORKSHEET_HEADINGS, WORKSHEET_NAMES,  # noqa: E402
+                     SheetsStorage, StorageError)
+
+ATHLETE = "athlete"
+WORKSHEET = "Rowing Ergometer"
+PASSWORD = "secret"
+PASSWORD_HASH = hash_password(PASSWORD)
+
+
+def username(number):
+    return f"user{number:06d}"
+
+
+def build_storage(size, args, name):
+    """
+    A SheetsStorage on a fake backend with `size` registered users,
+    `size` entries in the spreadsheet ID registry and an athlete
+    whose rowing worksheet has `size` workouts.
+    """
+    requests = Requests(latency=args.latency, error_rate=args.error_rate, seed=size)
+    client = FakeClient(requests, scheduled=True)
+    client.add_spreadsheet(CREDENTIALS_SPREADSHEET_NAME, [FakeWorksheet(
+        "Sheet1", requests, [["Username", "Password"]] + [[username(number), PASSWORD_HASH] for number in range(size)]
+    )])
+    # Two workouts a day.
+    first_day = datetime.date(1990, 1, 1)
+    history = [[(first_day + datetime.timedelta(days=number // 2)).strftime("%d-%m-%Y"),
+                "01:00:00", f"{10 + number % 10}.50"] for number in range(size)]
+    workbook = client.add_spreadsheet(f"{ATHLETE} UT2 Tracker Spreadsheet", [
+        FakeWorksheet(worksheet, requests, [WORKSHEET_HEADINGS] + (history if worksheet == WORKSHEET else []))
+        for worksheet in WORKSHEET_NAMES
+    ])
+
+    index = {username(number): f"id-of-{username(number)}" for number in range(size)}
+    index[ATHLETE] = workbook.id
+    os.environ["UT2_SPREADSHEET_INDEX"] = os.path.join(DIRECTORY, f"{name}-{size}-ids.json")
+    with open(os.environ["UT2_SPREADSHEET_INDEX"], "w") as index_file:
+        json.dump(index, index_file)
+
+    storage = SheetsStorage(
+        client=client,
+        share_with="coach@example.com",
+        aggregates=AggregateStore(os.path.join(DIRECTORY, f"{name}-{size}-aggregates.db")),
+        drive_service=FakeDriveService(client),
+    )
+    storage.scheduler.base_delay = args.retry_delay
+    return storage, requests
+
+
+def registration(storage, size, operation):
+    new_username = f"newuser{operation:06d}"
+    assert not storage.username_exists(new_username)
+    assert storage.add_user(new_username, PASSWORD_HASH)
+
+
+def provisioning(storage, size, operation):
+    new_username = f"newuser{operation:06d}"
+    assert not storage.user_workbook_exists(new_username)
+    storage.create_workbook(new_username)
+
+
+def login(storage, size, operation):
+    assert authenticate(storage, username(operation * 7919 % size), PASSWORD)
+
+
+def logging(storage, size, operation):
+    storage.append_workout(ATHLETE, WORKSHEET, ["02-01-2023", "00:45:00", "09.75"])
+
+
+def history(storage, size, operation):
+    start = operation * 7919 % size
+    assert storage.get_workouts_page(ATHLETE, WORKSHEET, start, 20)
+
+
+def averages(storage, size, operation):
+    assert storage.get_workout_stats(ATHLETE, WORKSHEET, last=3)["count"] == 3
+
+
+def first_averages(storage, size, operation):
+    averages(storage, size, operation)
+
+
+def trends(storage, size, operation):
+    assert storage.get_workout_trends(ATHLETE, WORKSHEET, "month")["points"]
+
+
+def first_trends(storage, size, operation):
+    trends(storage, size, operation)
+
+
+SCENARIOS = [
+    ("registration", registration, None),
+    ("provisioning", provisioning, None),
+    ("login", login, None),
+    ("logging", logging, None),
+    ("history", history, None),
+    ("averages first", first_averages, 1),
+    ("averages", averages, None),
+    ("trends first", first_trends, 1),
+    ("trends", trends, None),
+]
+
+
+def run_scenario(name, operation, size, operations, args):
+    storage, requests = build_storage(size, args, name)
+    if name in ["averages", "trends"]:
+        # Build the running totals first so only steady-state queries are timed.
+        operation(storage, size, 0)
+    requests.reset()
+    failures = 0
+    started = time.perf_counter()
+    for number in range(operations):
+        try:
+            operation(storage, size, number)
+        except (RequestFailed, StorageError):
+            failures += 1
+    elapsed = time.perf_counter() - started
+    retries = storage.scheduler.metrics().get("retries", 0)
+    print(f"{name:<15} {size:>8} {operations:>5} {elapsed:9.3f} {elapsed / operations * 1000:9.2f} "
+          f"{requests.total / operations:10.2f} {sum(requests.errors.values()):>7} {retries:>7} {failures:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 1000, 100_000],
+                        help="users, registry entries and rows of history already stored")
+    parser.add_argument("--ops", type=int, default=20, help="operations timed per scenario")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="simulated seconds per Google API request")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="share of requests failing with HTTP 429")
+    parser.add_argument("--retry-delay", type=float, default=0.01,
+                        help="base delay of the scheduler's exponential backoff")
+    parser.add_argument("--scenarios", nargs="+", choices=[name for name, _, _ in SCENARIOS],
+                        help="run only these scenarios")
+    args = parser.parse_args()
+
+    print("scenario            size   ops   total s     ms/op requests/op  errors retries failures")
+    for name, operation, operations in SCENARIOS:
+        if args.scenarios and name not in args.scenarios:
+            continue
+        for size in args.sizes:
+            run_scenario(name, operation, size, operations or args.ops, args)
+
+
+if __name__ == "__main__":
+    main()
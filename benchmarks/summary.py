@@ -0,0 +1,52 @@
+"""
+Compare a cross-machine summary fetched one worksheet at a time
+with the same summary fetched concurrently through AsyncStorage.
+
+Uses an in-memory fake Google Sheets client with simulated latency,
+so the concurrent version should take about one request's latency.
+
+Run from the project root with:
+    python -m benchmarks.summary --latency 0.2 --rows 1000
+"""
+import argparse
+import os
+import tempfile
+import time
+
+# Keep the benchmark's spreadsheet IDs out of the real index.
+os.environ["UT2_SPREADSHEET_INDEX"] = os.path.join(tempfile.mkdtemp(), "spreadsheet_ids.json")
+
+from async_storage import summarise_all_machines  # noqa: E402
+from benchmarks.fakes import FakeClient, FakeWorksheet, Requests  # noqa: E402
+from stats import workout_stats  # noqa: E402
+from storage import WORKSHEET_HEADINGS, WORKSHEET_NAMES, SheetsStorage  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--rows", type=int, default=1000)
+    args = parser.parse_args()
+
+    requests = Requests(latency=args.latency)
+    client = FakeClient(requests)
+    storage = SheetsStorage(client=client)
+    rows = [[f"{day % 28 + 1:02d}-01-2023", "01:00:00", "12.50"] for day in range(args.rows)]
+    client.add_spreadsheet(storage.workbook_name("someuser"), [
+        FakeWorksheet(worksheet, requests, [WORKSHEET_HEADINGS] + rows) for worksheet in WORKSHEET_NAMES
+    ])
+
+    started = time.perf_counter()
+    for worksheet in WORKSHEET_NAMES:
+        workout_stats(storage.get_workouts_frame("someuser", worksheet), worksheet)
+    print(f"sequential {time.perf_counter() - started:6.3f} s")
+
+    for worksheet in WORKSHEET_NAMES:
+        storage.invalidate_workouts("someuser", worksheet)
+    started = time.perf_counter()
+    summarise_all_machines(storage, "someuser")
+    print(f"concurrent {time.perf_counter() - started:6.3f} s")
+
+
+if __name__ == "__main__":
+    main()
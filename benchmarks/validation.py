@@ -0,0 +1,83 @@
+"""
+Time the duration and distance checks over a million typed-in values.
+
+Compares the old approach, which looked each pattern up on every call and
+raised and caught ValueError for every invalid value, with the compiled
+patterns and exception-free parsers in validation.py.
+
+Run from the project root with:
+    python -m benchmarks.validation --inputs 1000000
+"""
+import argparse
+import random
+import re
+import time
+
+from validation import is_valid_distance, is_valid_duration, parse_distance, parse_duration
+
+INVALID_DURATIONS = ["24:00:00", "1:00:00", "01:60:00", "", "01:00:00 "]
+INVALID_DISTANCES = ["12a50", "12.5", "1250", "", "ab.cd"]
+
+
+def sample_inputs(count, invalid_share, seed=1):
+    random_numbers = random.Random(seed)
+    durations = []
+    distances = []
+    for _ in range(count):
+        if random_numbers.random() < invalid_share:
+            durations.append(random_numbers.choice(INVALID_DURATIONS))
+            distances.append(random_numbers.choice(INVALID_DISTANCES))
+        else:
+            durations.append(f"{random_numbers.randrange(24):02d}:{random_numbers.randrange(60):02d}:"
+                             f"{random_numbers.randrange(60):02d}")
+            distances.append(f"{random_numbers.randrange(100):02d}.{random_numbers.randrange(100):02d}")
+    return durations, distances
+
+
+def old_duration_check(time_data):
+    try:
+        if not re.fullmatch(r'^([01]\d|2[0-3]):([0-5]\d):([0-5]\d)$', time_data):
+            raise ValueError(f"You entered {time_data}")
+        return True
+    except ValueError:
+        return False
+
+
+def old_distance_check(distance_data):
+    try:
+        if not re.fullmatch(r'\d\d.\d\d', str(distance_data)):
+            raise ValueError(f"You entered {distance_data}")
+        return True
+    except ValueError:
+        return False
+
+
+def measure(name, check, values):
+    started = time.perf_counter()
+    valid = 0
+    for value in values:
+        result = check(value)
+        if result is not None and result is not False:
+            valid += 1
+    elapsed = time.perf_counter() - started
+    print(f"{name:<17} {elapsed:8.3f} {len(values) / elapsed / 1e6:10.2f} {valid:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--inputs", type=int, default=1_000_000)
+    parser.add_argument("--invalid", type=float, default=0.2, help="share of invalid inputs")
+    args = parser.parse_args()
+
+    durations, distances = sample_inputs(args.inputs, args.invalid)
+    print("check              seconds  M inputs/s      valid")
+    measure("old duration", old_duration_check, durations)
+    measure("is_valid_duration", is_valid_duration, durations)
+    measure("parse_duration", parse_duration, durations)
+    measure("old distance", old_distance_check, distances)
+    measure("is_valid_distance", is_valid_distance, distances)
+    measure("parse_distance", parse_distance, distances)
+
+
+if __name__ == "__main__":
+    main()
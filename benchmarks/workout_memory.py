@@ -0,0 +1,71 @@
+"""
+Compare the memory held per workout as worksheet rows of strings and
+as WorkoutColumns, and the cost of showing a DataFrame of the history
+after each logged workout when the whole history is parsed again and
+when only the new row is.
+
+Run from the project root with:
+    python -m benchmarks.workout_memory --rows 100000 --appends 20
+"""
+import argparse
+import time
+import tracemalloc
+
+from workouts import Machine, WorkoutColumns
+
+
+def history(rows):
+    return [[f"{1 + row % 28:02d}-{1 + row // 28 % 12:02d}-{2000 + row // 336:04d}",
+             f"00:{row % 60:02d}:{row % 59:02d}", f"{10 + row % 10}.{row % 100:02d}"]
+            for row in range(rows)]
+
+
+def measure_memory(label, build, rows):
+    tracemalloc.start()
+    held = build()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del held
+    print(f"{label:<16} {size / rows:10.1f}")
+
+
+def measure_appends(label, refresh, appends):
+    started = time.perf_counter()
+    for _ in range(appends):
+        refresh(["02-01-2023", "00:30:00", "07.25"])
+    elapsed = time.perf_counter() - started
+    print(f"{label:<16} {elapsed * 1000 / appends:10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--appends", type=int, default=20, help="workouts logged, each followed by a frame")
+    args = parser.parse_args()
+
+    machine = Machine.ROWING_ERGOMETER
+    print(f"{args.rows} workouts")
+    print("held as          bytes each")
+    measure_memory("string rows", lambda: history(args.rows), args.rows)
+    rows = history(args.rows)
+    measure_memory("WorkoutColumns", lambda: WorkoutColumns.from_rows(rows, machine), args.rows)
+    print()
+
+    print("frame after      ms per append")
+
+    def reparse(row):
+        rows.append(row)
+        WorkoutColumns.from_rows(rows, machine).frame()
+
+    columns = WorkoutColumns.from_rows(rows, machine)
+
+    def extend(row):
+        columns.extend_rows([row], machine)
+        columns.frame()
+
+    measure_appends("full reparse", reparse, args.appends)
+    measure_appends("new row only", extend, args.appends)
+
+
+if __name__ == "__main__":
+    main()
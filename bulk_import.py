@@ -0,0 +1,140 @@
+"""
+Import a workout history from a CSV file without the interactive prompts.
+
+Each line of the file holds one workout: date, duration, distance, machine.
+For example:
+
+    date,duration,distance,machine
+    03-01-2023,01:00:00,12.50,Rowing Ergometer
+    2023-01-04,00:55:30,20.10,exercise bike
+
+Dates may be dd-mm-yyyy, as update_worksheet writes them, or yyyy-mm-dd.
+Durations and distances follow the same rules as the interactive prompts.
+Rows are written in batches with one append per batch and worksheet.
+
+Run from the project root with:
+    python bulk_import.py --username someuser history.csv
+"""
+import argparse
+import csv
+import datetime
+import sys
+
+from storage import WORKSHEET_NAMES, get_storage
+from validation import is_valid_distance, is_valid_duration
+
+DATE_FORMATS = ["%d-%m-%Y", "%Y-%m-%d"]
+
+
+def parse_machine(machine):
+    """
+    Return the worksheet name matching machine, ignoring case,
+    or None if it isn't one of the three workout types.
+    """
+    machine = machine.strip().lower()
+    for worksheet_name in WORKSHEET_NAMES:
+        if worksheet_name.lower() == machine:
+            return worksheet_name
+    return None
+
+
+def parse_date(date_text):
+    """
+    Return the date in the dd-mm-yyyy format used in the worksheets,
+    or None if it isn't in one of DATE_FORMATS.
+    """
+    for date_format in DATE_FORMATS:
+        try:
+            date = datetime.datetime.strptime(date_text.strip(), date_format)
+        except ValueError:
+            continue
+        return date.strftime("%d-%m-%Y")
+    return None
+
+
+def parse_workout_line(fields):
+    """
+    Turn the fields of one CSV line into (worksheet, row).
+    Raises ValueError describing the first invalid field.
+    """
+    if len(fields) != 4:
+        raise ValueError(f"expected 4 fields, found {len(fields)}")
+    date_text, time_data, distance_data, machine = [field.strip() for field in fields]
+    date_string = parse_date(date_text)
+    if date_string is None:
+        raise ValueError(f"invalid date {date_text!r}")
+    if not is_valid_duration(time_data):
+        raise ValueError(f"invalid duration {time_data!r}, expected 00:00:00")
+    if not is_valid_distance(distance_data):
+        raise ValueError(f"invalid distance {distance_data!r}, expected 00.00")
+    worksheet = parse_machine(machine)
+    if worksheet is None:
+        raise ValueError(f"unknown machine {machine!r}")
+    return worksheet, [date_string, time_data, distance_data]
+
+
+def import_workouts(storage, username, lines, batch_size=500, progress=print):
+    """
+    Stream workouts from CSV lines into the user's worksheets.
+    Rows are buffered per worksheet and written batch_size at a time.
+    Invalid lines are reported through progress and skipped.
+    Returns (number of rows imported, number of lines skipped).
+    """
+    buffers = {worksheet_name: [] for worksheet_name in WORKSHEET_NAMES}
+    imported = 0
+    skipped = 0
+
+    def flush(worksheet):
+        nonlocal imported
+        rows = buffers[worksheet]
+        if rows:
+            storage.append_workouts(username, worksheet, rows)
+            imported += len(rows)
+            progress(f"Imported {imported} workouts ({len(rows)} to {worksheet}).")
+            buffers[worksheet] = []
+
+    for line_number, fields in enumerate(csv.reader(lines), start=1):
+        if not fields or (line_number == 1 and fields[0].strip().lower() == "date"):
+            continue
+        try:
+            worksheet, row = parse_workout_line(fields)
+        except ValueError as error:
+            skipped += 1
+            progress(f"Skipping line {line_number}: {error}")
+            continue
+        buffers[worksheet].append(row)
+        if len(buffers[worksheet]) >= batch_size:
+            flush(worksheet)
+
+    for worksheet in WORKSHEET_NAMES:
+        flush(worksheet)
+    return imported, skipped
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import workouts from a CSV file.")
+    parser.add_argument("csv_file", help="CSV file to import, or - to read standard input")
+    parser.add_argument("--username", required=True)
+    parser.add_argument("--batch-size", type=int, default=500,
+                        help="rows written per request (default 500)")
+    parser.add_argument("--quiet", action="store_true", help="don't report progress")
+    args = parser.parse_args(argv)
+    if args.batch_size < 1:
+        parser.error("--batch-size must be at least 1")
+
+    storage = get_storage()
+    if not storage.user_workbook_exists(args.username):
+        parser.error(f"{args.username} doesn't have a UT2 Tracker workbook yet")
+
+    progress = (lambda message: None) if args.quiet else print
+    if args.csv_file == "-":
+        imported, skipped = import_workouts(storage, args.username, sys.stdin, args.batch_size, progress)
+    else:
+        with open(args.csv_file, newline="") as csv_file:
+            imported, skipped = import_workouts(storage, args.username, csv_file, args.batch_size, progress)
+    print(f"Imported {imported} workouts, skipped {skipped} invalid lines.")
+    return 1 if skipped else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,271 @@
+"""
+Non-interactive commands for scripts, kiosks and batch jobs.
+
+Every command prints JSON to standard output and exits with status 1
+if anything failed. For example:
+
+    python cli.py register --username someuser --password secret
+    python cli.py log --username someuser --machine "Rowing Ergometer" --duration 01:00:00 --distance 12.50
+    python cli.py history --username someuser --machine treadmill --from 01-01-2023
+    python cli.py stats --username someuser --machine "Exercise Bike" --last 10
+    python cli.py trends --username someuser --machine "Rowing Ergometer" --period week --since 01-01-2023
+    python cli.py export --directory exports --concurrency 16
+
+`log --batch` reads one JSON object per line from standard input, with
+the keys username, machine, duration, distance and optionally date,
+and writes them with one append per user and worksheet:
+
+    cat workouts.jsonl | python cli.py log --batch
+"""
+import argparse
+import json
+import sys
+from collections import defaultdict
+
+from aggregates import PERIODS
+from async_storage import summarise_all_machines
+from bulk_import import parse_date, parse_machine
+from history import HISTORY_PAGE_SIZE, history_date_argument, iter_history_pages, page_size_argument
+from passwords import authenticate, hash_password
+from storage import WORKSHEET_NAMES, get_storage, workout_row
+from validation import is_valid_credential, is_valid_distance, is_valid_duration
+
+
+class CommandError(Exception):
+    """
+    Raised when a command can't be completed because of its arguments.
+    """
+
+
+def machine_argument(machine):
+    worksheet = parse_machine(machine)
+    if worksheet is None:
+        raise argparse.ArgumentTypeError(f"choose from {', '.join(WORKSHEET_NAMES)}")
+    return worksheet
+
+
+def non_negative_argument(text):
+    number = int(text)
+    if number < 0:
+        raise argparse.ArgumentTypeError(f"must be 0 or more, not {number}")
+    return number
+
+
+def validated_workout(time_data, distance_data, date_text=None):
+    """
+    Check a workout with the same rules as the interactive prompts
+    and return the row to append.
+    """
+    if not isinstance(time_data, str) or not is_valid_duration(time_data):
+        raise CommandError(f"invalid duration {time_data!r}, expected 00:00:00")
+    if not isinstance(distance_data, str) or not is_valid_distance(distance_data):
+        raise CommandError(f"invalid distance {distance_data!r}, expected 00.00")
+    if date_text is not None and not isinstance(date_text, str):
+        raise CommandError(f"invalid date {date_text!r}")
+    row = workout_row(time_data, distance_data)
+    if date_text:
+        row[0] = parse_date(date_text)
+        if row[0] is None:
+            raise CommandError(f"invalid date {date_text!r}")
+    return row
+
+
+def ensure_workbook(storage, username):
+    """
+    Return True if username has a workbook, creating it first for a
+    registered user who doesn't have one yet, e.g. because provisioning
+    failed when they registered, as run.py's search_file does.
+    Returns False for usernames that aren't registered.
+    """
+    if storage.user_workbook_exists(username):
+        return True
+    if not storage.username_exists(username):
+        return False
+    storage.create_workbook(username)
+    return True
+
+
+def register_user(storage, username, password):
+    """
+    Register a user and create their workbook. Registering again with
+    the same password finishes a registration whose workbook couldn't
+    be created. Returns False if the username belongs to someone else
+    or is already fully registered.
+    """
+    if not storage.add_user(username, hash_password(password)):
+        if storage.user_workbook_exists(username) or not authenticate(storage, username, password):
+            return False
+    storage.create_workbook(username)
+    return True
+
+
+def register(storage, args):
+    if not is_valid_credential(args.username) or not is_valid_credential(args.password):
+        raise CommandError("usernames and passwords must be at least five lowercase letters")
+    if not register_user(storage, args.username, args.password):
+        raise CommandError(f"username {args.username} already exists")
+    return {"ok": True, "username": args.username}
+
+
+def log(storage, args):
+    if args.batch:
+        return log_batch(storage, sys.stdin)
+    if not (args.username and args.machine and args.duration and args.distance):
+        raise CommandError("log needs --username, --machine, --duration and --distance, or --batch")
+    row = validated_workout(args.duration, args.distance, args.date)
+    if not ensure_workbook(storage, args.username):
+        raise CommandError(f"{args.username} isn't a registered user")
+    storage.append_workout(args.username, args.machine, row)
+    return {"ok": True, "username": args.username, "machine": args.machine, "workout": row}
+
+
+def log_batch(storage, lines):
+    """
+    Validate every JSON line, then append the valid workouts grouped
+    by user and worksheet so each group is a single write.
+    """
+    batches = defaultdict(list)
+    errors = []
+    for line_number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            entry = json.loads(line)
+            machine = entry.get("machine", "")
+            worksheet = parse_machine(machine) if isinstance(machine, str) else None
+            if worksheet is None:
+                raise CommandError(f"unknown machine {machine!r}")
+            row = validated_workout(entry.get("duration", ""), entry.get("distance", ""), entry.get("date"))
+            username = entry["username"]
+            if not isinstance(username, str):
+                raise CommandError(f"invalid username {username!r}")
+        except (CommandError, KeyError, ValueError, AttributeError) as error:
+            errors.append({"line": line_number, "error": str(error)})
+            continue
+        batches[(username, worksheet)].append((line_number, row))
+
+    known_users = {}
+    logged = 0
+    for (username, worksheet), entries in batches.items():
+        if username not in known_users:
+            known_users[username] = ensure_workbook(storage, username)
+        if not known_users[username]:
+            errors.extend({"line": line_number, "error": f"{username} isn't a registered user"}
+                          for line_number, _ in entries)
+            continue
+        storage.append_workouts(username, worksheet, [row for _, row in entries])
+        logged += len(entries)
+    errors.sort(key=lambda error: error["line"])
+    return {"ok": not errors, "logged": logged, "errors": errors}
+
+
+def history(storage, args):
+    worksheets = [args.machine] if args.machine else WORKSHEET_NAMES
+    workouts = []
+    for worksheet, rows in iter_history_pages(storage, args.username, worksheets, args.page_size,
+                                              args.date_from, args.date_to):
+        workouts.extend(
+            {"machine": worksheet, "date": row[0], "duration": row[1], "distance": row[2]}
+            for row in rows
+        )
+    return {"ok": True, "username": args.username, "workouts": workouts}
+
+
+def stats(storage, args):
+    from stats import workout_stats
+
+    if args.machine and args.days is None:
+        machine_stats = [storage.get_workout_stats(args.username, args.machine, args.last)]
+    elif args.machine:
+        frame = storage.get_workouts_frame(args.username, args.machine)
+        machine_stats = [workout_stats(frame, args.machine, last=args.last, days=args.days)]
+    else:
+        # All three worksheets are fetched at the same time.
+        machine_stats = summarise_all_machines(storage, args.username, last=args.last, days=args.days)
+    return {"ok": True, "username": args.username, "stats": machine_stats}
+
+
+def trends(storage, args):
+    machines = [args.machine] if args.machine else WORKSHEET_NAMES
+    machine_trends = [storage.get_workout_trends(args.username, machine, args.period, args.since)
+                      for machine in machines]
+    return {"ok": True, "username": args.username, "trends": machine_trends}
+
+
+def export(storage, args):
+    # pyarrow is only needed here, so it is imported on first use.
+    from export import export_workouts
+
+    users, workouts = export_workouts(storage, args.directory, args.username or None,
+                                      args.concurrency, progress=lambda message: None)
+    return {"ok": True, "directory": args.directory, "users": users, "workouts": workouts}
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Unstoppable UT2 commands with JSON output.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    register_parser = commands.add_parser("register", help="register a new user")
+    register_parser.add_argument("--username", required=True)
+    register_parser.add_argument("--password", required=True)
+    register_parser.set_defaults(run=register)
+
+    log_parser = commands.add_parser("log", help="log a workout")
+    log_parser.add_argument("--username")
+    log_parser.add_argument("--machine", type=machine_argument)
+    log_parser.add_argument("--duration", help="00:00:00")
+    log_parser.add_argument("--distance", help="00.00 kilometres")
+    log_parser.add_argument("--date", help="dd-mm-yyyy or yyyy-mm-dd (default today)")
+    log_parser.add_argument("--batch", action="store_true",
+                            help="read JSON lines of workouts from standard input")
+    log_parser.set_defaults(run=log)
+
+    history_parser = commands.add_parser("history", help="list previous workouts")
+    history_parser.add_argument("--username", required=True)
+    history_parser.add_argument("--machine", type=machine_argument, help="default all machines")
+    history_parser.add_argument("--from", dest="date_from", type=history_date_argument, help="dd-mm-yyyy")
+    history_parser.add_argument("--to", dest="date_to", type=history_date_argument, help="dd-mm-yyyy")
+    history_parser.add_argument("--page-size", type=page_size_argument, default=HISTORY_PAGE_SIZE * 10,
+                                help="rows fetched per request")
+    history_parser.set_defaults(run=history)
+
+    stats_parser = commands.add_parser("stats", help="averages, totals and pace")
+    stats_parser.add_argument("--username", required=True)
+    stats_parser.add_argument("--machine", type=machine_argument, help="default all machines")
+    stats_parser.add_argument("--last", type=non_negative_argument, default=3, help="number of recent workouts")
+    stats_parser.add_argument("--days", type=non_negative_argument, help="only workouts in the last N days")
+    stats_parser.set_defaults(run=stats)
+
+    trends_parser = commands.add_parser("trends", help="weekly or monthly totals and personal records")
+    trends_parser.add_argument("--username", required=True)
+    trends_parser.add_argument("--machine", type=machine_argument, help="default all machines")
+    trends_parser.add_argument("--period", choices=list(PERIODS), default="month")
+    trends_parser.add_argument("--since", type=history_date_argument, help="dd-mm-yyyy")
+    trends_parser.set_defaults(run=trends)
+
+    export_parser = commands.add_parser("export", help="copy new workouts of every user to Parquet files")
+    export_parser.add_argument("--directory", default="exports")
+    export_parser.add_argument("--username", action="append", help="only these users (repeatable)")
+    export_parser.add_argument("--concurrency", type=int, default=8, help="worksheet reads in flight")
+    export_parser.set_defaults(run=export)
+    return parser
+
+
+def main(argv=None, storage=None):
+    args = build_parser().parse_args(argv)
+    try:
+        storage = storage or get_storage()
+        result = args.run(storage, args)
+    except CommandError as error:
+        result = {"ok": False, "error": str(error)}
+    except Exception as error:
+        # Storage failures, e.g. a missing creds.json, a workbook that
+        # can't be found or Google still failing after retries, are
+        # reported as JSON like everything else.
+        result = {"ok": False, "error": f"{type(error).__name__}: {error}"}
+    print(json.dumps(result, default=str))
+    return 0 if result["ok"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
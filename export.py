@@ -0,0 +1,210 @@
+"""
+Export every user's workouts to local Parquet files for analysis.
+
+Each sync only reads the rows added to each worksheet since the last
+one. Worksheets are append only, so the watermark kept for every
+worksheet is simply the number of rows already exported. Reads go
+through AsyncStorage, so a limited number of them are in flight at a
+time and each one passes through the storage's request scheduler.
+
+The export is a Hive partitioned Parquet dataset, one directory per
+machine, with the columns username, row (the workout's index in its
+worksheet), date, seconds and km:
+
+    exports/
+        _sync.json
+        machine=treadmill/part-000001.parquet
+        machine=rowing_ergometer/part-000001.parquet
+        ...
+
+It can be queried with pandas or pyarrow, for example:
+
+    pandas.read_parquet("exports", filters=[("machine", "=", "rowing_ergometer")])
+
+Run from the project root with:
+    python cli.py export --directory exports
+"""
+import asyncio
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from async_storage import AsyncStorage
+from storage import WORKSHEET_NAMES
+from workouts import EPOCH_ORDINAL, Machine, WorkoutColumns
+
+SYNC_FILE = "_sync.json"
+# Rows fetched per request when reading a worksheet's new rows.
+EXPORT_PAGE_SIZE = 5000
+# Users whose new rows are gathered into each set of part files.
+USERS_PER_PART = 500
+
+SCHEMA = pa.schema([
+    ("username", pa.dictionary(pa.int32(), pa.string())),
+    ("row", pa.uint32()),
+    ("date", pa.date32()),
+    ("seconds", pa.uint32()),
+    ("km", pa.float32()),
+])
+
+
+def partition_name(machine):
+    return f"machine={machine.name.lower()}"
+
+
+def part_name(part):
+    return f"part-{part:06d}.parquet"
+
+
+class SyncState:
+    """
+    The rows already exported from each worksheet and the number of the
+    next part file, kept in _sync.json in the export directory.
+
+    Part files are written before the state that covers them is saved.
+    If a sync stops in between, the part files numbered from next_part
+    hold rows the state doesn't know about, so they are deleted and
+    those rows are exported again.
+    """
+
+    def __init__(self, directory):
+        self.path = os.path.join(directory, SYNC_FILE)
+        try:
+            with open(self.path) as sync_file:
+                data = json.load(sync_file)
+        except FileNotFoundError:
+            data = {}
+        self.next_part = data.get("next_part", 1)
+        self.watermarks = data.get("watermarks", {})
+
+    def watermark(self, username, worksheet):
+        return self.watermarks.get(username, {}).get(worksheet, 0)
+
+    def save(self):
+        temporary_path = f"{self.path}.tmp"
+        with open(temporary_path, "w") as sync_file:
+            json.dump({"next_part": self.next_part, "watermarks": self.watermarks}, sync_file)
+        os.replace(temporary_path, self.path)
+
+    def remove_unsaved_parts(self, directory):
+        """
+        Delete part files written after the state was last saved.
+        """
+        for machine in Machine:
+            partition = os.path.join(directory, partition_name(machine))
+            if not os.path.isdir(partition):
+                continue
+            for file_name in os.listdir(partition):
+                if file_name.startswith(".") or (
+                        file_name.startswith("part-") and int(file_name[5:11]) >= self.next_part):
+                    os.remove(os.path.join(partition, file_name))
+
+
+def arrow_table(batches):
+    """
+    Build a table matching SCHEMA from (username, start, WorkoutColumns)
+    batches, where start is the worksheet index of the first workout.
+    """
+    usernames = [username for username, _, _ in batches]
+    indices = np.repeat(np.arange(len(batches), dtype=np.int32), [len(columns) for _, _, columns in batches])
+    rows = np.concatenate([np.arange(start, start + len(columns), dtype=np.uint32)
+                           for _, start, columns in batches])
+    ordinals = np.concatenate([np.frombuffer(columns.ordinals, dtype=np.uint32) for _, _, columns in batches])
+    seconds = np.concatenate([np.frombuffer(columns.seconds, dtype=np.uint32) for _, _, columns in batches])
+    km = np.concatenate([np.frombuffer(columns.km, dtype=np.float32) for _, _, columns in batches])
+    days = (ordinals.astype(np.int64) - EPOCH_ORDINAL).astype(np.int32)
+    return pa.Table.from_arrays([
+        pa.DictionaryArray.from_arrays(pa.array(indices), pa.array(usernames, pa.string())),
+        pa.array(rows),
+        pa.array(days, pa.date32(), mask=ordinals == 0),
+        pa.array(seconds),
+        pa.array(km),
+    ], schema=SCHEMA)
+
+
+def write_part(directory, machine, part, batches):
+    partition = os.path.join(directory, partition_name(machine))
+    os.makedirs(partition, exist_ok=True)
+    temporary_path = os.path.join(partition, f".{part_name(part)}.tmp")
+    pq.write_table(arrow_table(batches), temporary_path)
+    os.replace(temporary_path, os.path.join(partition, part_name(part)))
+
+
+async def read_new_rows(async_storage, username, worksheet, start, page_size=EXPORT_PAGE_SIZE):
+    """
+    Return the rows of a worksheet from index start onwards, a page at a time.
+    """
+    rows = []
+    while True:
+        page = await async_storage.call("get_workouts_page", username, worksheet, start + len(rows), page_size)
+        rows.extend(page)
+        if len(page) < page_size:
+            return rows
+
+
+async def read_user(async_storage, state, username):
+    """
+    Return {worksheet: (start, new rows)} for one user,
+    or an empty dictionary if they have no workbook.
+    """
+    if not await async_storage.call("user_workbook_exists", username):
+        return {}
+    starts = [state.watermark(username, worksheet) for worksheet in WORKSHEET_NAMES]
+    new_rows = await asyncio.gather(*[
+        read_new_rows(async_storage, username, worksheet, start)
+        for worksheet, start in zip(WORKSHEET_NAMES, starts)
+    ])
+    return {worksheet: (start, rows) for worksheet, start, rows in zip(WORKSHEET_NAMES, starts, new_rows)}
+
+
+async def sync(storage, directory, usernames=None, concurrency=8, progress=print):
+    """
+    Export the workouts added since the last sync of directory.
+    Returns the number of users read and of workouts exported.
+    """
+    os.makedirs(directory, exist_ok=True)
+    state = SyncState(directory)
+    state.remove_unsaved_parts(directory)
+    # asyncio's default executor has at most 32 threads and only
+    # a few on small machines, which would cap the reads in flight.
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(concurrency))
+    async_storage = AsyncStorage(storage, concurrency)
+    if usernames is None:
+        usernames = await async_storage.call("usernames")
+
+    exported = 0
+    for first in range(0, len(usernames), USERS_PER_PART):
+        group = usernames[first:first + USERS_PER_PART]
+        users = await asyncio.gather(*[read_user(async_storage, state, username) for username in group])
+
+        batches = {machine: [] for machine in Machine}
+        for username, worksheets in zip(group, users):
+            for worksheet, (start, rows) in worksheets.items():
+                if not rows:
+                    continue
+                machine = Machine.from_worksheet(worksheet)
+                batches[machine].append((username, start, WorkoutColumns.from_rows(rows, machine)))
+                state.watermarks.setdefault(username, {})[worksheet] = start + len(rows)
+                exported += len(rows)
+
+        written = False
+        for machine, machine_batches in batches.items():
+            if machine_batches:
+                write_part(directory, machine, state.next_part, machine_batches)
+                written = True
+        if written:
+            state.next_part += 1
+            state.save()
+        progress(f"Exported {exported} workouts from {first + len(group)} of {len(usernames)} users.")
+    return len(usernames), exported
+
+
+def export_workouts(storage, directory, usernames=None, concurrency=8, progress=print):
+    """
+    Blocking helper that runs sync in its own event loop.
+    """
+    return asyncio.run(sync(storage, directory, usernames, concurrency, progress))
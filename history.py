@@ -0,0 +1,138 @@
+"""
+Page through a user's workout history a screenful at a time.
+
+Only one page of rows is fetched from storage and held in memory at a
+time, so viewing a long history costs the same memory as a short one.
+Pages can be limited to a date range and to one or more worksheets.
+
+Run from the project root with:
+    python history.py --username someuser --machine "Rowing Ergometer" --from 01-01-2023
+"""
+import argparse
+import datetime
+
+from aggregates import row_date
+from storage import WORKSHEET_NAMES, get_storage
+
+HISTORY_PAGE_SIZE = 20
+
+
+def parse_history_date(date_text):
+    """
+    Parse a dd-mm-yyyy date as written by update_worksheet.
+    Returns None for blank or invalid dates.
+    """
+    try:
+        return datetime.datetime.strptime(date_text.strip(), "%d-%m-%Y").date()
+    except (AttributeError, ValueError):
+        return None
+
+
+def history_date_argument(date_text):
+    """
+    argparse type for --from, --to and --since, which rejects
+    invalid dates instead of quietly dropping the filter.
+    """
+    date = parse_history_date(date_text)
+    if date is None:
+        raise argparse.ArgumentTypeError(f"invalid date {date_text!r}, expected dd-mm-yyyy")
+    return date
+
+
+def page_size_argument(text):
+    """
+    argparse type for --page-size, which must be at least 1.
+    """
+    page_size = int(text)
+    if page_size < 1:
+        raise argparse.ArgumentTypeError(f"page size must be at least 1, not {page_size}")
+    return page_size
+
+
+def in_date_range(row, date_from=None, date_to=None):
+    """
+    Return True if the row's date lies between date_from and date_to,
+    inclusive. Either limit may be None.
+    """
+    if date_from is None and date_to is None:
+        return True
+    # Rows hold dates exactly as update_worksheet writes them,
+    # so they are read without strptime.
+    date = row_date(row[0]) if row else None
+    if date is None:
+        return False
+    if date_from is not None and date < date_from:
+        return False
+    if date_to is not None and date > date_to:
+        return False
+    return True
+
+
+def iter_history_pages(storage, username, worksheets, page_size=HISTORY_PAGE_SIZE,
+                       date_from=None, date_to=None):
+    """
+    Yield (worksheet, rows) one page at a time, oldest first.
+    Each page is fetched from storage with a single range request and
+    filtered to the date range, so pages may hold fewer than page_size rows.
+    """
+    if page_size < 1:
+        raise ValueError(f"page_size must be at least 1, not {page_size}")
+    for worksheet in worksheets:
+        start = 0
+        while True:
+            rows = storage.get_workouts_page(username, worksheet, start, page_size)
+            start += len(rows)
+            page = [row for row in rows if any(row) and in_date_range(row, date_from, date_to)]
+            if page:
+                yield worksheet, page
+            if len(rows) < page_size:
+                break
+
+
+def render_page(worksheet, rows):
+    """
+    Return one page of rows as a coloured grid table.
+    """
+    from tabulate import tabulate
+    from termcolor import colored
+
+    table = tabulate(rows, headers=["Date", "Duration", "Distance (km)"],
+                     tablefmt='grid', disable_numparse=True)
+    return colored(f"{worksheet}\n{table}", 'white', 'on_magenta')
+
+
+def page_through_history(storage, username, worksheets, page_size=HISTORY_PAGE_SIZE,
+                         date_from=None, date_to=None, ask_for_next_page=input):
+    """
+    Print the history one page at a time, asking before each further page.
+    Returns the number of workouts shown.
+    """
+    shown = 0
+    for page_number, (worksheet, rows) in enumerate(
+            iter_history_pages(storage, username, worksheets, page_size, date_from, date_to)):
+        if page_number and ask_for_next_page(
+                "Press Enter to see more workouts or type q to stop: ").strip().lower() == "q":
+            break
+        print(render_page(worksheet, rows))
+        shown += len(rows)
+    if not shown:
+        print("No workouts found.")
+    return shown
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="View workout history a page at a time.")
+    parser.add_argument("--username", required=True)
+    parser.add_argument("--machine", action="append", choices=WORKSHEET_NAMES,
+                        help="worksheet to show, may be repeated (default all)")
+    parser.add_argument("--from", dest="date_from", type=history_date_argument, help="dd-mm-yyyy")
+    parser.add_argument("--to", dest="date_to", type=history_date_argument, help="dd-mm-yyyy")
+    parser.add_argument("--page-size", type=page_size_argument, default=HISTORY_PAGE_SIZE)
+    args = parser.parse_args(argv)
+
+    page_through_history(get_storage(), args.username, args.machine or WORKSHEET_NAMES,
+                         args.page_size, args.date_from, args.date_to)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+"""
+Timers and call counters for the program's functions and every request
+it makes to Google, switched on with UT2_PROFILE=1.
+
+When profiling is off, timed() and instrument_methods() hand back the
+functions and classes they are given unchanged and wrap_client() leaves
+the client alone, so there is no cost at all. The flag is read once,
+when this module is first imported.
+
+Timings are inclusive: a function's time includes the calls it makes,
+and for the prompts, the time spent waiting for the user to type.
+METRICS.report() formats them as a table for the end of a session and
+METRICS.prometheus() in the Prometheus text exposition format.
+"""
+import functools
+import inspect
+import os
+import re
+import threading
+import time
+from urllib.parse import urlparse
+
+ENABLED = os.getenv("UT2_PROFILE", "0") == "1"
+
+# Upper bounds in seconds of the latency histogram buckets.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Path segments that hold IDs or ranges rather than naming an operation.
+ID_SEGMENT = re.compile(r"(spreadsheets|files|values|permissions|sheets)/[^/:]+")
+
+
+class Timer:
+    """
+    Count, total, maximum and histogram of the durations of one kind of call.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * len(BUCKETS)
+
+    def add(self, seconds, failed):
+        self.count += 1
+        self.errors += failed
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        for index, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.buckets[index] += 1
+                break
+
+
+class Metrics:
+    """
+    Thread-safe collection of Timers by name.
+    """
+
+    def __init__(self):
+        self._timers = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, seconds, failed=False):
+        with self._lock:
+            timer = self._timers.get(name)
+            if timer is None:
+                timer = self._timers[name] = Timer()
+            timer.add(seconds, failed)
+
+    def reset(self):
+        with self._lock:
+            self._timers.clear()
+
+    def _snapshot(self):
+        with self._lock:
+            return sorted(
+                ((name, timer.count, timer.errors, timer.total, timer.max, list(timer.buckets))
+                 for name, timer in self._timers.items()),
+                key=lambda item: item[3], reverse=True,
+            )
+
+    def report(self):
+        """
+        Return a table of every timed call, slowest in total first.
+        """
+        lines = [f"{'call':<60} {'count':>6} {'errors':>6} {'total s':>9} {'mean ms':>9} {'max ms':>9}"]
+        for name, count, errors, total, longest, _ in self._snapshot():
+            lines.append(f"{name[:60]:<60} {count:>6} {errors:>6} {total:>9.3f} "
+                         f"{total / count * 1000:>9.1f} {longest * 1000:>9.1f}")
+        return "\n".join(lines)
+
+    def prometheus(self, counters=None):
+        """
+        Return the timers in the Prometheus text exposition format,
+        followed by any extra counters given as a name -> value dictionary.
+        """
+        snapshot = self._snapshot()
+        lines = [
+            "# HELP ut2_call_seconds Time taken by functions and Google API requests.",
+            "# TYPE ut2_call_seconds histogram",
+        ]
+        for name, count, _, total, _, buckets in snapshot:
+            label = f'name="{escape_label(name)}"'
+            cumulative = 0
+            for bound, bucket in zip(BUCKETS, buckets):
+                cumulative += bucket
+                lines.append(f'ut2_call_seconds_bucket{{{label},le="{bound}"}} {cumulative}')
+            lines.append(f'ut2_call_seconds_bucket{{{label},le="+Inf"}} {count}')
+            lines.append(f"ut2_call_seconds_sum{{{label}}} {total}")
+            lines.append(f"ut2_call_seconds_count{{{label}}} {count}")
+        lines += [
+            "# HELP ut2_call_errors_total Calls that raised an exception.",
+            "# TYPE ut2_call_errors_total counter",
+        ]
+        for name, _, errors, _, _, _ in snapshot:
+            lines.append(f'ut2_call_errors_total{{name="{escape_label(name)}"}} {errors}')
+        for name, value in (counters or {}).items():
+            lines.append(f"# TYPE ut2_{name}_total counter")
+            lines.append(f"ut2_{name}_total {value}")
+        return "\n".join(lines) + "\n"
+
+
+METRICS = Metrics()
+
+
+def escape_label(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _timed_call(name, function, args, kwargs):
+    started = time.perf_counter()
+    failed = True
+    try:
+        result = function(*args, **kwargs)
+        failed = False
+        return result
+    finally:
+        METRICS.record(name, time.perf_counter() - started, failed)
+
+
+def timed(name=None):
+    """
+    Decorator that records how long each call takes under name,
+    the function's name by default. Does nothing unless ENABLED.
+    """
+    def decorator(function):
+        if not ENABLED:
+            return function
+        label = name or function.__name__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            return _timed_call(label, function, args, kwargs)
+        return wrapper
+    return decorator
+
+
+def instrument_methods(cls):
+    """
+    Class decorator that times every public method of cls, including
+    inherited ones, as ClassName.method. Does nothing unless ENABLED.
+    """
+    if not ENABLED:
+        return cls
+    for attribute, value in inspect.getmembers(cls, inspect.isfunction):
+        if not attribute.startswith("_"):
+            setattr(cls, attribute, timed(f"{cls.__name__}.{attribute}")(value))
+    return cls
+
+
+def google_operation(method, endpoint):
+    """
+    Name a Google API request by its method and path, with IDs and
+    ranges replaced, e.g. "sheets POST /v4/spreadsheets/{id}/values/{id}:append".
+    """
+    url = urlparse(endpoint)
+    api = "drive" if "/drive/" in url.path else "sheets"
+    path = ID_SEGMENT.sub(r"\1/{id}", url.path)
+    return f"google {api} {method.upper()} {path}"
+
+
+def wrap_client(client):
+    """
+    Time every request a gspread client makes, by google_operation.
+    Does nothing unless ENABLED.
+    """
+    if not ENABLED or not hasattr(client, "request"):
+        return client
+    original_request = client.request
+
+    def timed_request(method, endpoint, *args, **kwargs):
+        return _timed_call(google_operation(method, endpoint), original_request, (method, endpoint, *args), kwargs)
+
+    client.request = timed_request
+    return client
@@ -0,0 +1,350 @@
+import fcntl
+import glob
+import itertools
+import json
+import logging
+import os
+import threading
+import uuid
+from collections import defaultdict
+
+import instrumentation
+from storage import StorageError
+
+logger = logging.getLogger(__name__)
+
+
+def journal_path(path, slot):
+    """
+    Path of one process's journal: path itself for slot 0,
+    then e.g. workout_journal.1.jsonl, workout_journal.2.jsonl.
+    """
+    if slot == 0:
+        return path
+    root, extension = os.path.splitext(path)
+    return f"{root}.{slot}{extension}"
+
+
+def try_lock(journal_file_path):
+    """
+    Take an exclusive lock on the journal's lock file without waiting.
+    Returns the open lock file, which holds the lock until it is
+    closed or the process exits, or None if another process has it.
+    Lock files are never deleted, so every process locks the same inode.
+    """
+    lock_file = open(f"{journal_file_path}.lock", "a")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return None
+    return lock_file
+
+
+# Rows read at a time when looking for an in-doubt batch in a worksheet.
+SETTLE_PAGE_SIZE = 500
+
+
+def unique(records):
+    """
+    Return records without repeats of the same object,
+    such as the "sending" record shared by a batch's keys.
+    """
+    return list({id(record): record for record in records}.values())
+
+
+def read_journal(journal_file_path):
+    """
+    Return (undelivered entries by key, {key: "sending" record} for the
+    ones that were being sent) from a journal file, which may be missing.
+    """
+    entries = {}
+    sending = {}
+    delivered = set()
+    try:
+        with open(journal_file_path) as journal_file:
+            for line in journal_file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A line cut short by a crash was never acknowledged.
+                    continue
+                if record["type"] == "workout":
+                    entries[record["key"]] = record
+                elif record["type"] == "sending":
+                    # A later attempt replaces an earlier one, which
+                    # was found not to have reached storage.
+                    sending.update((key, record) for key in record["keys"])
+                elif record["type"] == "delivered":
+                    delivered.update(record["keys"])
+    except FileNotFoundError:
+        pass
+    pending = {key: entry for key, entry in entries.items() if key not in delivered}
+    return pending, {key: record for key, record in sending.items() if key in pending}
+
+
+@instrumentation.instrument_methods
+class WorkoutJournal:
+    """
+    Write-behind queue for logged workouts.
+
+    Each workout is first appended to a local JSON lines file and synced
+    to disk, so logging returns straight away and survives a crash. A
+    background thread then delivers pending workouts to storage in
+    batches, one append_workouts call per user and worksheet.
+
+    Several processes may share one journal path, e.g. one run.py per
+    terminal session. Each process takes its own journal file, numbered
+    after path, and holds an exclusive lock on it while it runs, so no
+    journal is replayed or compacted while its process is alive. On
+    start, a process also takes over the journals of processes that
+    stopped without delivering everything.
+
+    Every workout carries an idempotency key. Before a batch is written
+    it is marked "sending" in the journal along with the number of rows
+    its worksheet held, and it is marked "delivered" afterwards. When the
+    journal is replayed, workouts that were never sent are simply queued
+    again. Workouts that were being sent when the program stopped, or
+    whose append failed, are only sent again if the worksheet's rows
+    after that count don't include the batch, so rows logged before it
+    and rows other writers added since are told apart from it. That
+    check is made by the next delivery, not when the journal is opened,
+    so an unreachable storage can't stop the program starting.
+    """
+
+    def __init__(self, path, storage, batch_size=100, flush_interval=2.0):
+        self.storage = storage
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._pending = {}
+        self._in_doubt = {}
+        self._lock = threading.Lock()
+        self._delivery_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        self.path, self._lock_file = self._claim(path)
+        self._replay(path)
+        self._file = open(self.path, "a")
+
+    @staticmethod
+    def _claim(path):
+        """
+        Lock the first journal file no other process holds.
+        Returns its path and its lock file.
+        """
+        for slot in itertools.count():
+            journal_file_path = journal_path(path, slot)
+            lock_file = try_lock(journal_file_path)
+            if lock_file is not None:
+                return journal_file_path, lock_file
+
+    def _orphans(self, path):
+        """
+        Yield (journal path, lock file) for every other journal
+        sharing path whose process is no longer running.
+        """
+        root, extension = os.path.splitext(path)
+        candidates = [path] + sorted(glob.glob(f"{glob.escape(root)}.*{glob.escape(extension)}"))
+        for candidate in candidates:
+            if candidate == self.path or not os.path.exists(candidate):
+                continue
+            lock_file = try_lock(candidate)
+            if lock_file is not None:
+                yield candidate, lock_file
+
+    def _write(self, record):
+        self._file.write(json.dumps(record) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def _replay(self, path):
+        """
+        Rebuild the pending workouts from this process's journal file and
+        any orphaned ones, then rewrite this file with only those workouts.
+        """
+        pending, in_doubt = read_journal(self.path)
+        adopted = []
+        for orphan_path, lock_file in self._orphans(path):
+            orphan_pending, orphan_in_doubt = read_journal(orphan_path)
+            for key, entry in orphan_pending.items():
+                pending.setdefault(key, entry)
+            for key, sending in orphan_in_doubt.items():
+                in_doubt.setdefault(key, sending)
+            adopted.append((orphan_path, lock_file))
+        self._pending = pending
+        self._in_doubt = in_doubt
+
+        temporary_path = f"{self.path}.tmp"
+        with open(temporary_path, "w") as journal_file:
+            for entry in pending.values():
+                journal_file.write(json.dumps(entry) + "\n")
+            # Still unknown whether these reached storage.
+            for sending in unique(in_doubt.values()):
+                journal_file.write(json.dumps(sending) + "\n")
+            journal_file.flush()
+            os.fsync(journal_file.fileno())
+        os.replace(temporary_path, self.path)
+
+        # Their workouts are safely in this journal now.
+        for orphan_path, lock_file in adopted:
+            os.remove(orphan_path)
+            lock_file.close()
+            logger.info("Took over undelivered workouts from %s", orphan_path)
+        if pending:
+            logger.info("Replayed %d undelivered workouts into %s", len(pending), self.path)
+
+    def _rows_since(self, username, worksheet, start):
+        """
+        Return a worksheet's rows from index start onwards.
+        """
+        rows = []
+        while True:
+            page = self.storage.get_workouts_page(username, worksheet, start + len(rows), SETTLE_PAGE_SIZE)
+            rows.extend(page)
+            if len(page) < SETTLE_PAGE_SIZE:
+                return rows
+
+    def _was_delivered(self, sending, rows):
+        """
+        Return True if rows were appended to the worksheet after the
+        row count recorded when they were marked as sending.
+        """
+        appended = self._rows_since(sending["username"], sending["worksheet"], sending["row_count"])
+        return any(appended[index:index + len(rows)] == rows
+                   for index in range(len(appended) - len(rows) + 1))
+
+    def _settle_in_doubt(self, errors):
+        """
+        Drop in-doubt workouts that reached storage, so they aren't
+        appended twice, and queue the others to be sent again. Batches
+        that can't be checked yet stay in doubt and their errors are
+        added to errors.
+        """
+        with self._lock:
+            batches = [
+                (sending, [self._pending[key] for key in sending["keys"] if key in self._pending])
+                for sending in unique(self._in_doubt.values())
+            ]
+        for sending, entries in batches:
+            keys = [entry["key"] for entry in entries]
+            try:
+                delivered = bool(entries) and self._was_delivered(sending, [entry["row"] for entry in entries])
+            except Exception as error:
+                errors.append(error)
+                logger.warning("Couldn't check whether %d workouts for %s reached %s",
+                               len(entries), sending["username"], sending["worksheet"], exc_info=True)
+                continue
+            with self._lock:
+                if delivered:
+                    self._write({"type": "delivered", "keys": keys})
+                for key in sending["keys"]:
+                    self._in_doubt.pop(key, None)
+                    if delivered:
+                        self._pending.pop(key, None)
+
+    def log(self, username, worksheet, row):
+        """
+        Journal one workout and queue it for delivery.
+        Returns its idempotency key.
+        """
+        entry = {"type": "workout", "key": uuid.uuid4().hex,
+                 "username": username, "worksheet": worksheet, "row": list(row)}
+        with self._lock:
+            self._write(entry)
+            self._pending[entry["key"]] = entry
+            batch_ready = len(self._pending) >= self.batch_size
+        if batch_ready:
+            self._wake.set()
+        return entry["key"]
+
+    def pending_count(self):
+        with self._lock:
+            return len(self._pending)
+
+    def flush(self):
+        """
+        Deliver every pending workout now.
+        Returns the number of workouts delivered. A user and worksheet
+        whose workouts can't be delivered doesn't hold up the others;
+        its workouts stay pending and StorageError is raised at the end.
+        """
+        with self._delivery_lock:
+            errors = []
+            if self._in_doubt:
+                self._settle_in_doubt(errors)
+            with self._lock:
+                batch = [entry for key, entry in self._pending.items() if key not in self._in_doubt]
+            groups = defaultdict(list)
+            for entry in batch:
+                groups[(entry["username"], entry["worksheet"])].append(entry)
+
+            delivered = 0
+            for (username, worksheet), group in groups.items():
+                keys = [entry["key"] for entry in group]
+                try:
+                    sending = {"type": "sending", "keys": keys, "username": username, "worksheet": worksheet,
+                               "row_count": self.storage.workout_count(username, worksheet)}
+                    with self._lock:
+                        self._write(sending)
+                except Exception as error:
+                    errors.append(error)
+                    logger.warning("Couldn't deliver %d workouts for %s to %s",
+                                   len(group), username, worksheet, exc_info=True)
+                    continue
+                try:
+                    self.storage.append_workouts(username, worksheet, [entry["row"] for entry in group])
+                except Exception as error:
+                    # The append may still have reached storage.
+                    with self._lock:
+                        self._in_doubt.update((key, sending) for key in keys)
+                    errors.append(error)
+                    logger.warning("Couldn't deliver %d workouts for %s to %s",
+                                   len(group), username, worksheet, exc_info=True)
+                    continue
+                with self._lock:
+                    self._write({"type": "delivered", "keys": keys})
+                    for key in keys:
+                        self._pending.pop(key, None)
+                delivered += len(group)
+            if errors:
+                raise StorageError(f"{len(errors)} batches of workouts couldn't be delivered "
+                                   f"and are kept for later ({errors[0]})") from errors[0]
+            return delivered
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                # Keep the workouts queued and try again next time.
+                logger.warning("Couldn't deliver journalled workouts, will retry", exc_info=True)
+
+    def start(self):
+        """
+        Start delivering pending workouts in a background thread.
+        """
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="workout-journal", daemon=True)
+            self._thread.start()
+        self._wake.set()
+
+    def stop(self):
+        """
+        Stop the background thread after one last delivery attempt.
+        Workouts that still couldn't be delivered stay in the journal
+        and are sent the next time it is opened.
+        """
+        self._stopping.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        try:
+            self.flush()
+        except Exception:
+            logger.warning("%d workouts left in %s for next time", self.pending_count(), self.path)
+        self._file.close()
+        self._lock_file.close()
@@ -0,0 +1,70 @@
+import base64
+import hashlib
+import hmac
+import os
+
+# Passwords are stored as scrypt$<cost>$<r>$<p>$<salt>$<hash>, where the
+# scrypt work factor N is 2 ** cost. Raising UT2_PASSWORD_COST makes each
+# login slower and guessing harder; existing hashes are upgraded the next
+# time their owner logs in.
+PASSWORD_COST = int(os.getenv("UT2_PASSWORD_COST", "14"))
+BLOCK_SIZE = 8
+PARALLELISM = 1
+SALT_BYTES = 16
+HASH_BYTES = 32
+PREFIX = "scrypt$"
+
+
+def _scrypt(password, salt, cost, block_size, parallelism):
+    n = 2 ** cost
+    return hashlib.scrypt(password.encode(), salt=salt, n=n, r=block_size, p=parallelism,
+                          maxmem=256 * n * block_size * parallelism + 2 ** 20, dklen=HASH_BYTES)
+
+
+def _encode(data):
+    return base64.b64encode(data).decode()
+
+
+def hash_password(password, cost=None):
+    """
+    Return a salted scrypt hash of the password for storage.
+    """
+    cost = PASSWORD_COST if cost is None else cost
+    salt = os.urandom(SALT_BYTES)
+    digest = _scrypt(password, salt, cost, BLOCK_SIZE, PARALLELISM)
+    return f"{PREFIX}{cost}${BLOCK_SIZE}${PARALLELISM}${_encode(salt)}${_encode(digest)}"
+
+
+def verify_password(password, stored):
+    """
+    Check a password against a stored value in constant time.
+    Returns (matches, needs_rehash). needs_rehash is True when the stored
+    value is plaintext from before passwords were hashed, or was hashed
+    with different settings from the current ones.
+    """
+    if not stored.startswith(PREFIX):
+        return hmac.compare_digest(password.encode(), stored.encode()), True
+    try:
+        cost, block_size, parallelism, salt, digest = stored[len(PREFIX):].split("$")
+        cost, block_size, parallelism = int(cost), int(block_size), int(parallelism)
+        salt, digest = base64.b64decode(salt), base64.b64decode(digest)
+    except ValueError:
+        return False, False
+    candidate = _scrypt(password, salt, cost, block_size, parallelism)
+    needs_rehash = (cost, block_size, parallelism) != (PASSWORD_COST, BLOCK_SIZE, PARALLELISM)
+    return hmac.compare_digest(candidate, digest), needs_rehash
+
+
+def authenticate(storage, username, password):
+    """
+    Return True if the password is correct for the username.
+    Plaintext or outdated hashes are replaced with a current hash
+    once the password has been checked.
+    """
+    stored_password = storage.get_password(username)
+    if not stored_password:
+        return False
+    matches, needs_rehash = verify_password(password, stored_password)
+    if matches and needs_rehash:
+        storage.update_password(username, hash_password(password))
+    return matches
@@ -1,43 +1,39 @@
-import gspread
+import logging
 import os
+import sys
 from dotenv import load_dotenv
-from google.oauth2.service_account import Credentials
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
 from rich.console import Console
+from rich.live import Live
+from rich.text import Text
 import time
 import colorama
 import re
-import datetime
-import pandas as pd
-from tabulate import tabulate
-from termcolor import colored
 
-# Load environment variables from .env file
+# Load environment variables from .env file before the
+# modules below read their settings from the environment.
 load_dotenv()
 
-# Define OAuth 2.0 scopes
-SCOPE = [
-    "https://www.googleapis.com/auth/spreadsheets",
-    "https://www.googleapis.com/auth/drive.file",
-    "https://www.googleapis.com/auth/drive"
-]
-
-# Load service account credentials
-
-CREDS = Credentials.from_service_account_file("creds.json")
-SCOPED_CREDS = CREDS.with_scopes(SCOPE)
-
-# Authorize gspread with scoped credentials
-GSPREAD_CLIENT = gspread.authorize(SCOPED_CREDS)
-
-# Open Google Sheets documents
-SHEET = GSPREAD_CLIENT.open('UnstoppableUT2 Tracker Spreadsheet')
-USERNAME_PASSWORD_DATA_SHEET = GSPREAD_CLIENT.open('UnstoppableUT2 Username and Password Data Spreadsheet')
+import instrumentation
+from instrumentation import timed
+from journal import WorkoutJournal
+from passwords import authenticate, hash_password
+from scheduler import RequestFailed
+from storage import StorageError, get_storage, workout_row
+from validation import is_valid_distance, is_valid_duration
 
 # Get email address from environment variables
 email_address = os.getenv("EMAIL_ADDRESS")
 
+# Diagnostic messages, such as API calls per signup, are logged
+# at INFO level and hidden unless UT2_LOG_LEVEL=INFO is set.
+logging.basicConfig(level=os.getenv("UT2_LOG_LEVEL", "WARNING"))
+
+# Connect to the storage backend chosen in the environment.
+# Google Sheets is used unless UT2_STORAGE_BACKEND=sqlite.
+# The connection is made the first time it is needed,
+# so starting the program does no network I/O.
+STORAGE = get_storage(email_address=email_address)
+
 
 colorama.init()
 
@@ -50,6 +46,25 @@ M = colorama.Fore.MAGENTA
 
 console = Console()
 
+# Logged workouts are written to a local journal first and delivered
+# to storage in the background, unless UT2_WRITE_BEHIND=0.
+WRITE_BEHIND = os.getenv("UT2_WRITE_BEHIND", "1") != "0"
+JOURNAL = None
+
+# How print_incrementally shows text:
+# "buffered" types it out in chunks redrawn in a single live region,
+# "animated" prints one character at a time and
+# "instant" prints everything at once.
+# Scripted sessions, where input isn't a terminal, always use "instant".
+TEXT_MODE = os.getenv("UT2_TEXT_MODE", "buffered")
+# Typing speed in characters per second for "buffered" and "animated".
+TEXT_SPEED = float(os.getenv("UT2_TEXT_SPEED", "50"))
+# Longest time in seconds "buffered" spends typing out one text.
+# Longer texts are typed faster so that they finish within it.
+TEXT_MAX_SECONDS = float(os.getenv("UT2_TEXT_MAX_SECONDS", "1.5"))
+# Number of times per second the "buffered" live region is redrawn.
+TEXT_FRAME_RATE = 30
+
 
 def print_banner():
     """
@@ -83,15 +98,37 @@ def print_banner():
     console.print('                                             ')
 
 
+@timed()
 def print_incrementally(console, text):
-    
-    for char in text:
-        console.print(char, end='', highlight=False)
-        console.print('', end='', highlight=False)  # Flush the output
-        time.sleep(0.02)
-    console.print('')  # Add a newline after the text is printed
-
-
+    """
+    Print text as if it were being typed, following TEXT_MODE and TEXT_SPEED.
+    """
+    mode = TEXT_MODE if sys.stdin.isatty() else "instant"
+    # Text.from_ansi drops trailing newlines, so they are added back at the end.
+    trailing_newlines = "\n" * (len(text) - len(text.rstrip("\n")))
+    if mode == "instant" or TEXT_SPEED <= 0:
+        console.print(Text.from_ansi(text), end='', highlight=False)
+        console.print(trailing_newlines, highlight=False)
+    elif mode == "animated":
+        for char in text:
+            console.print(char, end='', highlight=False)
+            console.print('', end='', highlight=False)  # Flush the output
+            time.sleep(1 / TEXT_SPEED)
+        console.print('')  # Add a newline after the text is printed
+    else:
+        # Redraw a growing slice of the text a few times a second
+        # instead of printing and sleeping after every character.
+        rich_text = Text.from_ansi(text)
+        speed = max(TEXT_SPEED, len(rich_text) / TEXT_MAX_SECONDS)
+        chunk_size = max(1, round(speed / TEXT_FRAME_RATE))
+        with Live(console=console, auto_refresh=False) as live:
+            for end in range(chunk_size, len(rich_text) + chunk_size, chunk_size):
+                live.update(rich_text[:end], refresh=True)
+                time.sleep(chunk_size / speed)
+        console.print(trailing_newlines, highlight=False)
+
+
+@timed()
 def new_user_or_existing_user():
     """
     Prompts the user to choose between new or existing user, and performs the corresponding actions.
@@ -127,18 +164,22 @@ def new_user_or_existing_user():
             print_incrementally(console, error_text)
 
 
+@timed()
 def register_new_user():
     """
     Registers a new user.
     """
     while True:
         username = type_username()
+        username_exists_text = f"{R}Username already exists. Please select a different one."
         if search_username(username):
-            username_exists_text = f"{R}Username already exists. Please select a different one."
             print_incrementally(console, username_exists_text)
         else:
             password = type_new_password()
-            write_username_and_password_to_data_sheet(username, password)
+            if not write_username_and_password_to_data_sheet(username, password):
+                # Someone else registered the same username in the meantime.
+                print_incrementally(console, username_exists_text)
+                continue
             search_file(username)
             break
 
@@ -160,17 +201,13 @@ def type_username():
             return username
 
 
+@timed()
 def search_username(username):
     """
     This function will check the username_password_data_sheet
     to see if the username already exists.
     """
-    worksheet = USERNAME_PASSWORD_DATA_SHEET.sheet1
-    usernames = worksheet.col_values(1)
-    if username in usernames:
-        return True
-    else:
-        return False
+    return STORAGE.username_exists(username)
 
 
 def type_new_password():
@@ -189,48 +226,28 @@ def type_new_password():
             return password
 
 
-# This code block was taken almost directly from
-# the documentation for Google's Drive API.
-# You can find it here: https://developers.google.com/drive/api/guides/search-files
+@timed()
 def search_file(username):
-    """Search file in drive location
-
-    Load pre-authorized user credentials from the environment.
     """
-    creds = CREDS
-
+    Check whether the user already has a UT2 Tracker workbook.
+    Existing users go straight to their options, new users
+    get a workbook created for them and log their first workout.
+    """
     try:
-        # create drive api client
-        service = build('drive', 'v3', credentials=creds)
-        files = []
-        page_token = None
-        while True:
-            # pylint: disable=maybe-no-member
-            response = service.files().list(q=f"name='{username} UT2 Tracker Spreadsheet'",
-                                            spaces='drive',
-                                            fields='nextPageToken,'
-                                                   'files(name)',
-                                            pageToken=page_token).execute()
-            for file in response.get('files', []):
-                # Process change
-                if f'{username} UT2 Tracker Spreadsheet' in file['name']:
-                    existing_user_choice(username)
-                    return
-            files.extend(response.get('files', []))
-            page_token = response.get('nextPageToken', None)
-            if not files:
-                print(f"{G}Thanks for signing up {M}{username}!\n")
-                create_new_user_workbook(username)
-                user_workout_choice(username)
-            if page_token is None:
-                break       
-    except HttpError as error:
+        workbook_exists = STORAGE.user_workbook_exists(username)
+    except StorageError as error:
         print(F'An error occurred: {error}')
-        files = None
-
-    return files
+        return None
+    if workbook_exists:
+        existing_user_choice(username)
+    else:
+        print(f"{G}Thanks for signing up {M}{username}!\n")
+        create_new_user_workbook(username)
+        user_workout_choice(username)
+    return workbook_exists
 
 
+@timed()
 def existing_user_choice(username):
     """
     This will allow an existing user
@@ -283,6 +300,7 @@ def existing_user_choice(username):
         calculate_average_workout_scores(worksheet, username)
  
 
+@timed()
 def login_existing_user():
     """
     Logs in an existing user.
@@ -305,6 +323,7 @@ def login_existing_user():
                 new_user_or_existing_user()
 
          
+@timed()
 def existing_user():
     """
     This function is called if the user is an existing user.
@@ -324,75 +343,41 @@ def existing_user():
             print_incrementally(console, username_not_found_text)
 
 
+@timed()
 def check_password(username, password):
     """
     This function checks if the given password matches the password for the given username.
     """
-    worksheet = USERNAME_PASSWORD_DATA_SHEET.sheet1
-    row = None
-    try:
-        cell = worksheet.find(username)
-        row = cell.row
-        stored_password = worksheet.cell(row, 2).value
-    except gspread.exceptions.CellNotFound:
-        return False
-    if stored_password == password:
-        return True
-    else:
-        return False
+    return authenticate(STORAGE, username, password)
 
 
+@timed()
 def write_username_and_password_to_data_sheet(username, password):
     """
     This will add the user's username and password
     to the username and password spreadsheet.
+    Returns False if the username was taken in the meantime.
     """
-    worksheet = USERNAME_PASSWORD_DATA_SHEET.sheet1
-    next_row = len(worksheet.get_all_values()) + 1
-    new_row = [username, password]
-    worksheet.insert_row(new_row, next_row)
+    if not STORAGE.add_user(username, hash_password(password)):
+        return False
     print(f"{G}User added successfully!\n")
+    return True
 
 
+@timed()
 def create_new_user_workbook(username):
     """
     Creates new spreadsheet in Google Sheets.
     """
-    # Create new workbook with three worksheets.
-    # Workbook will include user's typed username.
-    # Three worksheets have titles listed below.
-    # Default "Sheet1" worksheet gets deleted.
-    # Worksheet list object created to be referred to later when formatting.
-    user_workbook = GSPREAD_CLIENT.create(f"{username} UT2 Tracker Spreadsheet")
-    worksheet_names = ["Treadmill", "Rowing Ergometer", "Exercise Bike"]
-    worksheets = []
-    for worksheet_name in worksheet_names:
-        worksheet = user_workbook.add_worksheet(title=worksheet_name, rows=1000, cols=3)
-        worksheets.append(worksheet)
-    user_workbook.del_worksheet(user_workbook.sheet1)
-    # Add cell formatting rule to be applied to all worksheets.
-    cell_format = {
-        "textFormat": {
-            "bold": True
-        }
-    }
-    cells_to_format = ['A1', 'B1', 'C1']
-    for cell in cells_to_format:
-        for worksheet in worksheets:
-            worksheet.format(cell, cell_format)
-    # Created nested for loops to iterate cell headings
-    # across all three of user's worksheets.
-    all_worksheet_types = user_workbook.worksheets()
-    worksheet_headings = ["Date", "Duration", "Distance"]
-    for i, worksheet in enumerate(all_worksheet_types):
-        for j in range (3):
-            worksheet.update_cell(1, j+1, worksheet_headings[j])
-    if email_address:
-        user_workbook.share(email_address, perm_type='user', role='writer')
-    else:
+    # Workbook will include user's typed username and
+    # one worksheet each for "Treadmill", "Rowing Ergometer"
+    # and "Exercise Bike" with bold headings.
+    STORAGE.create_workbook(username)
+    if not email_address:
         print("Email address not found in the environment variables.")
 
 
+@timed()
 def user_workout_choice(username):
     """
     This will allow user to select which workout they want to log
@@ -444,83 +429,59 @@ def user_workout_choice(username):
         update_worksheet(time_data, distance_data, "Exercise Bike", username)
 
 
+@timed()
 def display_all_previous_workout_entries(worksheet, username):
     """
-    This function will allow the user to see their data from 
-    past workouts.
+    This function will allow the user to see their data from
+    past workouts, one page at a time.
     """
-    username_sheet = GSPREAD_CLIENT.open(f'{username} UT2 Tracker Spreadsheet')
-    workout_type_to_be_displayed = username_sheet.worksheet(worksheet)
-    columns = []
-    for ind in range(1, 4):
-        column = workout_type_to_be_displayed.col_values(ind)
-        columns.append(column)
-    df = pd.DataFrame(columns).transpose()
-    df.columns = ["Column 1", "Column 2", "Column 3"]
+    # Each page is fetched and rendered on its own, so long
+    # histories don't have to be loaded all at once.
+    from history import page_through_history
 
-    # Convert DataFrame to tabulate table
-    table = tabulate(df, headers='keys', tablefmt='grid')
+    deliver_pending_workouts()
+    return page_through_history(STORAGE, username, [worksheet])
 
-    # Apply color to the entire table
-    colored_table = colored(table, 'white', 'on_magenta')
 
-    # Print the colorized table
-    print(colored_table)
-
-    return df
-
-
-def calculate_average_workout_scores(worksheet, username):
+@timed()
+def calculate_average_workout_scores(worksheet, username, last=3):
     """
     This function will display the user's average
     workout duration and distance covered for a given
-    workout type using the 3 most recent entries.
-    """
-    username_sheet = GSPREAD_CLIENT.open(f'{username} UT2 Tracker Spreadsheet')
-    workout_type_to_be_displayed = username_sheet.worksheet(worksheet)
-    duration_column_entries = workout_type_to_be_displayed.col_values(2)
-    if len(duration_column_entries) >= 4:
-        duration_column_last_three_entries = duration_column_entries[-3:]
-        # Convert time values to seconds
-        # The code on the line below used to convert existing time data in the worksheet into seconds was generated by ChatGPT.
-        seconds = [datetime.datetime.strptime(t, '%H:%M:%S').time().second + datetime.datetime.strptime(t, '%H:%M:%S').time().minute * 60 + datetime.datetime.strptime(t, '%H:%M:%S').time().hour * 3600 for t in duration_column_last_three_entries]
-        # Calculate average of seconds
-        avg_seconds = sum(seconds) / len(seconds)
-        # Convert average seconds back to hh:mm:ss format
-        avg_time = str(datetime.timedelta(seconds=avg_seconds))
-        print(f"Your average workout duration for your last three {M}{worksheet}")
+    workout type using the `last` most recent entries.
+    """
+    # stats needs pandas, so it is imported on first use.
+    from stats import format_seconds
+
+    deliver_pending_workouts()
+    # Answered from running totals, however long the history is.
+    workouts = STORAGE.get_workout_stats(username, worksheet, last=last)
+    if workouts["count"] == 0:
+        print(f"{W}You haven't logged any {worksheet} workouts yet.")
+        return workouts
+
+    avg_time = format_seconds(workouts["average_seconds"])
+    avg_distance = workouts["average_km"]
+    if workouts["count"] >= last:
+        print(f"Your average workout duration for your last {last} {M}{worksheet}")
         print(f"{W}workouts is {M}{avg_time}.")
-    elif len(duration_column_entries) < 4 and len(duration_column_entries) > 1:
-        print(f"{W}You haven't logged three {worksheet} workouts yet,")
+        print(f"Your average distance covered in km for your last {last}")
+        print(f"{M}{worksheet}{W} workouts is {M}{avg_distance}.")
+    else:
+        print(f"{W}You haven't logged {last} {worksheet} workouts yet,")
         print(f"but here's your existing data anyway!")
-        # Convert time values to seconds
-        seconds = [datetime.datetime.strptime(t, '%H:%M:%S').time().second + datetime.datetime.strptime(t, '%H:%M:%S').time().minute * 60 + datetime.datetime.strptime(t, '%H:%M:%S').time().hour * 3600 for t in duration_column_entries[1:]]
-        # Calculate average of seconds
-        avg_seconds = sum(seconds) / len(seconds)
-        # Convert average seconds back to hh:mm:ss format
-        avg_time = str(datetime.timedelta(seconds=avg_seconds))
         print(f"Your average workout duration for your {M}{worksheet}")
         print(f"{W} is {M}{avg_time}.")
-    elif len(duration_column_entries) <= 1:
-        print(f"{W}You haven't logged any {worksheet} workouts yet.")
-
-    distance_column_entries = workout_type_to_be_displayed.col_values(3)
-    if len(distance_column_entries) >= 4:
-        distance_column_last_three_entries = distance_column_entries[-3:]
-        distance_column_last_three_entries = [float(entry) for entry in distance_column_entries[1:]]
-        avg_distance = sum(distance_column_last_three_entries) / len(distance_column_last_three_entries)
-        print(f"Your average distance covered in km for your last three")
-        print(f"{M}{worksheet}{W} workouts is {M}{avg_distance}.")
-    elif len(distance_column_entries) < 4 and len(distance_column_entries) > 1:
-        distance_column_entries = [float(entry) for entry in distance_column_entries[1:]]
-        avg_distance = sum(distance_column_entries) / len(distance_column_entries)
-        print(f"{W}Your average distance covered in km for your last three")
+        print(f"{W}Your average distance covered in km for your")
         print(f"{M}{worksheet}{W} workouts is{M} {avg_distance}.")
-    elif len(distance_column_entries) <= 1:
-        pass
+    if workouts["pace_seconds_per_km"]:
+        print(f"{W}Your average pace is {M}{format_seconds(workouts['pace_seconds_per_km'])}{W} per km.")
+    if workouts["split_seconds_per_500m"]:
+        print(f"{W}Your average split is {M}{format_seconds(workouts['split_seconds_per_500m'])}{W} per 500m.")
+    return workouts
 
 
-# The try/except format of this code block comes from
+# The messages in these validators come from
 # Code Institute's Love Sandwiches Walkthrough Project.
 def validate_user_workout_duration_input(time_data):
     """
@@ -530,25 +491,14 @@ def validate_user_workout_duration_input(time_data):
     the second two digits correspond to minutes
     and the last two digist correspond to seconds.
     """
-    time_format = re.compile(r'^([01]\d|2[0-3]):([0-5]\d):([0-5]\d)$')
-    try:
-        match = time_format.fullmatch(time_data)
-        if match is None:
-            print(
-                f"{R}Your workout time must be less than 24 hours.{W}The value for minutes must be\nless than 60. The value for seconds must be less than 60. You entered {R}{time_data}"
-                )
-            raise ValueError(
-                f"{R}Your workout time must be less than 24 hours.\n{W}The value for minutes must be less than 60. The value for seconds must be less than 60.\nYou entered {R}{time_data}"
-                )
-        else:
-            return True
-    except ValueError as e:
-        print(f"{R}Invalid data: {e}, please try again.\n")
-        return False
+    if is_valid_duration(time_data):
+        return True
+    print(
+        f"{R}Invalid data: Your workout time must be less than 24 hours.\n{W}The value for minutes must be less than 60. The value for seconds must be less than 60.\nYou entered {R}{time_data}, please try again.\n"
+        )
+    return False
 
 
-# The try/except format for this code block was taken from
-# Code Institue's Love Sandwiches Walkthrough Project.
 def validate_user_workout_distance_input(distance_data):
     """
     This will ensure that the user may only
@@ -556,21 +506,12 @@ def validate_user_workout_distance_input(distance_data):
     the digits correspond to kilometers measured
     to two decimal places.
     """
-    distance_format = re.compile(r'\d\d.\d\d')
-    while True:
-        try:
-            distance_data_str = str(distance_data)
-            match = distance_format.fullmatch(distance_data_str)
-            if match is None:
-                raise ValueError(
-                    f"{R}Your distance in kilometres should be entered in this format - 00.00.\n You entered {distance_data}"
-                    )
-            break
-        except ValueError as e:
-            print(f"{R}Invalid data: {e}, please try again.\n")
-            distance_data = input("Input your distance covered in kilometres in this format - 00.00 ")
-    
-    return True
+    if is_valid_distance(distance_data):
+        return True
+    print(
+        f"{R}Invalid data: Your distance in kilometres should be entered in this format - 00.00.\n You entered {distance_data}, please try again.\n"
+        )
+    return False
 
 
 def input_workout_duration_info():
@@ -608,27 +549,78 @@ def input_workout_distance_info():
 
 # The basis for this code is taken almost directly from
 # Code Institute's Love Sandwiches Walkthrough Project.
+@timed()
 def update_worksheet(time_data, distance_data, worksheet, username):
     """
     This function will add the user's workout distance
     and duration data and append it to a row in their
     spreadsheet along with the date of data entry.
     """
-    username_sheet = GSPREAD_CLIENT.open(f'{username} UT2 Tracker Spreadsheet')
-    worksheet_to_update = username_sheet.worksheet(worksheet)
-    current_date = datetime.datetime.now()
-    date_string = current_date.strftime("%d-%m-%Y")
-    row_to_append = [date_string, time_data, distance_data]
-    worksheet_to_update.append_row(row_to_append)
+    row_to_append = workout_row(time_data, distance_data)
+    if JOURNAL is not None:
+        JOURNAL.log(username, worksheet, row_to_append)
+    else:
+        STORAGE.append_workout(username, worksheet, row_to_append)
     print(f"{G}{worksheet} worksheet updated successfully.")
 
 
+@timed()
+def deliver_pending_workouts():
+    """
+    Make sure journalled workouts have reached storage
+    before previous workouts are read back.
+    """
+    if JOURNAL is not None:
+        try:
+            JOURNAL.flush()
+        except StorageError as error:
+            # Other users' workouts may be the ones stuck, so carry on
+            # with what storage already holds.
+            print(f"{R}Some logged workouts couldn't be saved yet ({error}).")
+            print(f"{R}They'll be sent again shortly.\n")
+
+
 def main():
     """
     Run all programme functions
     """
+    global JOURNAL
+    try:
+        if WRITE_BEHIND:
+            JOURNAL = WorkoutJournal(os.getenv("UT2_JOURNAL_PATH", "workout_journal.jsonl"), STORAGE)
+            JOURNAL.start()
+        run_sessions()
+    finally:
+        if JOURNAL is not None:
+            JOURNAL.stop()
+        if instrumentation.ENABLED:
+            report_session_metrics()
+
+
+def report_session_metrics():
+    """
+    Print where this session's time went and save it
+    as Prometheus text metrics to UT2_PROFILE_PATH.
+    """
+    metrics = instrumentation.METRICS
+    print(f"\n{W}Where this session's time went:\n{metrics.report()}")
+    scheduler = getattr(STORAGE, "scheduler", None)
+    counters = scheduler.metrics() if scheduler is not None else None
+    with open(os.getenv("UT2_PROFILE_PATH", "ut2_metrics.prom"), "w") as metrics_file:
+        metrics_file.write(metrics.prometheus(counters))
+
+
+def run_sessions():
+    """
+    Keep offering the program until the user leaves.
+    """
     while True:
-        new_user_or_existing_user()
+        try:
+            new_user_or_existing_user()
+        except (StorageError, RequestFailed) as error:
+            # Google kept rate limiting or failing even after retrying.
+            print(f"{R}Sorry, your data couldn't be reached right now ({error}).")
+            print(f"{R}Please try again in a minute.\n")
         continue_or_quit_choice = input(f"{Y}Type 1 to run the program again or 2 to leave Unstoppable UT2 for today: ")
         print("")
         if continue_or_quit_choice == '1':
@@ -639,5 +631,6 @@ def main():
             print(f'{R}Invalid choice. Please try again.\n')
 
 
-print_banner()
-main()
\ No newline at end of file
+if __name__ == "__main__":
+    print_banner()
+    main()
@@ -0,0 +1,222 @@
+import json
+import os
+import random
+import re
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+
+# HTTP statuses worth retrying: rate limiting and temporary server errors.
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# A server error doesn't say whether a write was applied, so requests
+# that aren't idempotent are only retried when Google rate limited them,
+# which it does before carrying them out.
+WRITE_RETRY_STATUSES = {429}
+# Methods that have the same effect however many times they are sent.
+IDEMPOTENT_METHODS = {"get", "head", "put", "delete"}
+SPREADSHEET_ID = re.compile(r"/spreadsheets/([^/:?]+)")
+
+
+class RequestFailed(Exception):
+    """
+    Raised when a request is still rate limited or failing
+    after every retry. The last error is its __cause__.
+    """
+
+
+def error_status(error):
+    """
+    Return the HTTP status carried by a gspread APIError
+    or a googleapiclient HttpError, or None for other errors.
+    """
+    response = getattr(error, "response", None)
+    if response is not None and hasattr(response, "status_code"):
+        return response.status_code
+    resp = getattr(error, "resp", None)
+    if resp is not None and hasattr(resp, "status"):
+        return int(resp.status)
+    return None
+
+
+class TokenBucket:
+    """
+    Allows bursts of up to per_minute requests and
+    refills at per_minute requests a minute after that.
+    """
+
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.tokens = per_minute
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, sleep=time.sleep):
+        """
+        Take one token, waiting for it if necessary.
+        Returns the number of seconds spent waiting.
+        """
+        waited = 0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                wait = (1 - self.tokens) / self.rate
+            sleep(wait)
+            waited += wait
+
+
+class RequestScheduler:
+    """
+    Central gate for every Google API request.
+
+    Requests are grouped into kinds ("read", "write" and "drive") that each
+    get a token bucket matching their per-minute quota. Rate limited and
+    temporarily failing requests are retried with jittered exponential
+    backoff, except that requests which aren't idempotent, such as
+    appending rows, are only retried when rate limited. Identical reads that are already in flight are coalesced so
+    only one of them reaches Google. Counters are available from metrics().
+    """
+
+    def __init__(self, quotas, max_retries=5, base_delay=1.0, max_delay=32.0, sleep=time.sleep):
+        self.buckets = {kind: TokenBucket(per_minute) for kind, per_minute in quotas.items()}
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.sleep = sleep
+        self.counters = Counter()
+        self._counters_lock = threading.Lock()
+        self._in_flight = {}
+        self._in_flight_lock = threading.Lock()
+        # Writes finished per spreadsheet, so reads never join
+        # one that started before a write they should see.
+        self._writes = Counter()
+
+    @classmethod
+    def from_environment(cls):
+        """
+        Build a scheduler using Google's default per-user quotas,
+        which can be changed with UT2_READ_QUOTA, UT2_WRITE_QUOTA
+        and UT2_DRIVE_QUOTA (requests per minute).
+        """
+        return cls(
+            {
+                "read": float(os.getenv("UT2_READ_QUOTA", "60")),
+                "write": float(os.getenv("UT2_WRITE_QUOTA", "60")),
+                "drive": float(os.getenv("UT2_DRIVE_QUOTA", "12000")),
+            },
+            max_retries=int(os.getenv("UT2_MAX_RETRIES", "5")),
+        )
+
+    def _count(self, name, amount=1):
+        with self._counters_lock:
+            self.counters[name] += amount
+
+    def metrics(self):
+        """
+        Return a snapshot of the counters: requests, retries,
+        coalesced reads, failures and seconds spent throttled.
+        """
+        with self._counters_lock:
+            return dict(self.counters)
+
+    def run(self, kind, call, *args, key=None, idempotent=True, **kwargs):
+        """
+        Make one request of the given kind by calling call(*args, **kwargs).
+        If key is given and a request with the same key is already in
+        flight, wait for its result instead of making another request.
+        Requests that aren't idempotent are not retried after server
+        errors, as they may already have been carried out.
+        """
+        retry_statuses = RETRY_STATUSES if idempotent else WRITE_RETRY_STATUSES
+        if key is None:
+            return self._run_with_retries(kind, call, args, kwargs, retry_statuses)
+
+        with self._in_flight_lock:
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._in_flight[key] = future
+        if not leader:
+            self._count("coalesced")
+            return future.result()
+
+        try:
+            result = self._run_with_retries(kind, call, args, kwargs, retry_statuses)
+        except BaseException as error:
+            future.set_exception(error)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._in_flight_lock:
+                del self._in_flight[key]
+
+    def _run_with_retries(self, kind, call, args, kwargs, retry_statuses=RETRY_STATUSES):
+        attempt = 0
+        while True:
+            throttled = self.buckets[kind].acquire(self.sleep)
+            if throttled:
+                self._count("throttled_seconds", throttled)
+            self._count("requests")
+            self._count(f"{kind}_requests")
+            try:
+                return call(*args, **kwargs)
+            except Exception as error:
+                status = error_status(error)
+                if status not in retry_statuses:
+                    raise
+                if attempt >= self.max_retries:
+                    self._count("failures")
+                    raise RequestFailed(f"Google API request failed with status {status} "
+                                        f"after {attempt} retries") from error
+                # Full jitter: wait a random time up to the exponential delay.
+                delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+                attempt += 1
+                self._count("retries")
+                self._count(f"status_{status}")
+                self.sleep(delay)
+
+    def wrap_client(self, client):
+        """
+        Route every request a gspread client makes through the scheduler.
+        GET requests to the Sheets API are reads and can be coalesced,
+        other Sheets requests are writes and Drive requests are "drive".
+        POST and PATCH requests are only retried when rate limited.
+        A GET only joins an identical one in flight if no write to the
+        same spreadsheet (or to Drive) has finished since that one began,
+        so a caller that writes and then reads sees its own write.
+        """
+        original_request = client.request
+
+        def scheduled_request(method, endpoint, *args, **kwargs):
+            if "googleapis.com/drive" in endpoint:
+                kind = "drive"
+            elif method.lower() == "get":
+                kind = "read"
+            else:
+                kind = "write"
+            match = SPREADSHEET_ID.search(endpoint)
+            resource = match.group(1) if match else kind
+            if method.lower() != "get":
+                try:
+                    return self.run(kind, original_request, method, endpoint, *args,
+                                    idempotent=method.lower() in IDEMPOTENT_METHODS, **kwargs)
+                finally:
+                    # Counted even when it failed, as it may still have been applied.
+                    with self._in_flight_lock:
+                        self._writes[resource] += 1
+            with self._in_flight_lock:
+                writes = self._writes[resource]
+            key = (endpoint, writes, json.dumps([args, kwargs], sort_keys=True, default=str))
+            return self.run(kind, original_request, method, endpoint, *args, key=key, **kwargs)
+
+        client.request = scheduled_request
+        return client
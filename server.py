@@ -0,0 +1,311 @@
+"""
+Serve Unstoppable UT2 to many users from one process.
+
+Every request is handled by a bounded pool of worker threads that share
+one storage backend, so all sessions share a single authorised Google
+client, its connection pool, the request scheduler and every cache.
+
+The API speaks JSON:
+
+    POST /register  {"username": ..., "password": ...}
+    POST /login     {"username": ..., "password": ...}  -> {"token": ...}
+    POST /logout
+    POST /workouts  {"machine": ..., "duration": "01:00:00", "distance": "12.50"}
+    GET  /workouts?machine=Treadmill&start=0&count=20
+    GET  /stats?machine=Treadmill&last=3
+    GET  /trends?machine=Treadmill&period=month&since=01-01-2023
+    GET  /metrics   Prometheus text metrics, when UT2_PROFILE=1
+
+Requests other than register and login need an
+"Authorization: Bearer <token>" header from /login.
+
+Failures return {"ok": false, "error": ...} with a 4xx status for bad
+requests, 503 when storage can't be reached and 500 for anything else.
+Idle connections are closed after IDLE_TIMEOUT seconds.
+
+Run from the project root with:
+    python server.py --port 8080 --workers 32
+"""
+import argparse
+import json
+import logging
+import secrets
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import instrumentation
+from aggregates import PERIODS
+from bulk_import import parse_machine
+from cli import CommandError, ensure_workbook, register_user, validated_workout
+from history import parse_history_date
+from passwords import authenticate
+from scheduler import RequestFailed
+from storage import WORKSHEET_NAMES, StorageError, get_storage
+from validation import is_valid_credential
+
+logger = logging.getLogger(__name__)
+
+SESSION_SECONDS = 12 * 60 * 60
+# Seconds a connection may sit idle before it is closed and its
+# worker thread is free for other clients.
+IDLE_TIMEOUT = 15
+
+
+class Sessions:
+    """
+    Thread-safe map of login token -> username, expiring after SESSION_SECONDS.
+    """
+
+    def __init__(self):
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def start(self, username):
+        token = secrets.token_urlsafe(32)
+        with self._lock:
+            self._sessions[token] = (username, time.monotonic() + SESSION_SECONDS)
+        return token
+
+    def username(self, token):
+        with self._lock:
+            session = self._sessions.get(token)
+            if session is None:
+                return None
+            if session[1] < time.monotonic():
+                del self._sessions[token]
+                return None
+            return session[0]
+
+    def end(self, token):
+        with self._lock:
+            self._sessions.pop(token, None)
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class UT2Server(HTTPServer):
+    """
+    HTTPServer that hands each connection to a fixed-size thread pool
+    instead of starting a thread per connection.
+    """
+
+    # Let bursts of new connections queue rather than being refused.
+    request_queue_size = 128
+
+    def __init__(self, address, storage, workers=32):
+        super().__init__(address, UT2RequestHandler)
+        self.storage = storage
+        self.sessions = Sessions()
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix="ut2-session")
+
+    def process_request(self, request, client_address):
+        self.executor.submit(self._process_request_thread, request, client_address)
+
+    def _process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=True)
+
+
+class UT2RequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Each open connection holds a pool thread, so idle keep-alive
+    # connections mustn't hold them forever.
+    timeout = IDLE_TIMEOUT
+
+    def log_message(self, format, *args):
+        # Keep the console quiet under load.
+        pass
+
+    def do_GET(self):
+        if self.path == "/metrics" and instrumentation.ENABLED:
+            self._send_metrics()
+            return
+        self._dispatch({"/workouts": self.list_workouts, "/stats": self.stats, "/trends": self.trends})
+
+    def do_POST(self):
+        self._dispatch({
+            "/register": self.register,
+            "/login": self.login,
+            "/logout": self.logout,
+            "/workouts": self.log_workout,
+        })
+
+    def _dispatch(self, routes):
+        url = urlparse(self.path)
+        self.query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        handler = routes.get(url.path)
+        try:
+            if handler is None:
+                raise HTTPError(404, "not found")
+            status, body = 200, instrumentation.timed(f"{self.command} {url.path}")(handler)()
+        except HTTPError as error:
+            status, body = error.status, {"ok": False, "error": str(error)}
+        except CommandError as error:
+            status, body = 400, {"ok": False, "error": str(error)}
+        except (StorageError, RequestFailed) as error:
+            # Google kept rate limiting or failing even after retrying.
+            logger.warning("Storage unavailable for %s %s: %s", self.command, url.path, error)
+            status, body = 503, {"ok": False, "error": "storage is unavailable, please try again shortly"}
+        except Exception:
+            logger.exception("Error handling %s %s", self.command, url.path)
+            status, body = 500, {"ok": False, "error": "internal error"}
+        self._send_json(status, body)
+
+    def _send_json(self, status, body):
+        payload = json.dumps(body, default=str).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _send_metrics(self):
+        scheduler = getattr(self.server.storage, "scheduler", None)
+        counters = scheduler.metrics() if scheduler is not None else None
+        payload = instrumentation.METRICS.prometheus(counters).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _json_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            raise HTTPError(400, "request body must be JSON")
+        if not isinstance(body, dict):
+            raise HTTPError(400, "request body must be a JSON object")
+        return body
+
+    def _text(self, body, key, default=""):
+        """
+        Return a string field of a JSON body, or default if it is missing.
+        """
+        value = body.get(key, default)
+        if value is not default and not isinstance(value, str):
+            raise HTTPError(400, f"{key} must be a string")
+        return value
+
+    def _token(self):
+        authorization = self.headers.get("Authorization", "")
+        return authorization[len("Bearer "):] if authorization.startswith("Bearer ") else ""
+
+    def _username(self):
+        username = self.server.sessions.username(self._token())
+        if username is None:
+            raise HTTPError(401, "log in first")
+        return username
+
+    def _machine(self, machine):
+        worksheet = parse_machine(machine or "")
+        if worksheet is None:
+            raise HTTPError(400, f"machine must be one of {', '.join(WORKSHEET_NAMES)}")
+        return worksheet
+
+    def register(self):
+        body = self._json_body()
+        username, password = self._text(body, "username"), self._text(body, "password")
+        if not is_valid_credential(username) or not is_valid_credential(password):
+            raise HTTPError(400, "usernames and passwords must be at least five lowercase letters")
+        if not register_user(self.server.storage, username, password):
+            raise HTTPError(409, f"username {username} already exists")
+        return {"ok": True, "username": username, "token": self.server.sessions.start(username)}
+
+    def login(self):
+        body = self._json_body()
+        username, password = self._text(body, "username"), self._text(body, "password")
+        if not authenticate(self.server.storage, username, password):
+            raise HTTPError(401, "incorrect username or password")
+        # Finish a registration whose workbook couldn't be created.
+        ensure_workbook(self.server.storage, username)
+        return {"ok": True, "username": username, "token": self.server.sessions.start(username)}
+
+    def logout(self):
+        self.server.sessions.end(self._token())
+        return {"ok": True}
+
+    def log_workout(self):
+        username = self._username()
+        body = self._json_body()
+        worksheet = self._machine(self._text(body, "machine"))
+        row = validated_workout(self._text(body, "duration"), self._text(body, "distance"),
+                                self._text(body, "date", None))
+        self.server.storage.append_workout(username, worksheet, row)
+        return {"ok": True, "machine": worksheet, "workout": row}
+
+    def list_workouts(self):
+        username = self._username()
+        worksheet = self._machine(self.query.get("machine"))
+        try:
+            start = int(self.query.get("start", 0))
+            count = min(int(self.query.get("count", 20)), 1000)
+        except ValueError:
+            raise HTTPError(400, "start and count must be numbers")
+        if start < 0 or count < 1:
+            raise HTTPError(400, "start must be at least 0 and count at least 1")
+        rows = self.server.storage.get_workouts_page(username, worksheet, start, count)
+        return {"ok": True, "machine": worksheet, "start": start, "workouts": [
+            {"date": row[0], "duration": row[1], "distance": row[2]} for row in rows
+        ]}
+
+    def stats(self):
+        username = self._username()
+        worksheet = self._machine(self.query.get("machine"))
+        try:
+            last = int(self.query.get("last", 3))
+        except ValueError:
+            raise HTTPError(400, "last must be a number")
+        if last < 0:
+            raise HTTPError(400, "last must be at least 0")
+        return {"ok": True, "stats": self.server.storage.get_workout_stats(username, worksheet, last)}
+
+    def trends(self):
+        username = self._username()
+        worksheet = self._machine(self.query.get("machine"))
+        period = self.query.get("period", "month")
+        if period not in PERIODS:
+            raise HTTPError(400, f"period must be one of {', '.join(PERIODS)}")
+        since = None
+        if self.query.get("since"):
+            since = parse_history_date(self.query["since"])
+            if since is None:
+                raise HTTPError(400, "since must be a dd-mm-yyyy date")
+        return {"ok": True, "trends": self.server.storage.get_workout_trends(username, worksheet, period, since)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve Unstoppable UT2 as a JSON API.")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--workers", type=int, default=32, help="concurrent requests")
+    args = parser.parse_args()
+
+    server = UT2Server((args.host, args.port), get_storage(), args.workers)
+    print(f"Serving Unstoppable UT2 on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+import datetime
+
+import pandas as pd
+
+from aggregates import summarise
+
+
+def format_seconds(seconds):
+    """
+    Format a number of seconds as h:mm:ss, rounded to the nearest second.
+    """
+    return str(datetime.timedelta(seconds=round(float(seconds))))
+
+
+def workout_stats(frame, worksheet, last=3, days=None, today=None):
+    """
+    Summarise a WorkoutColumns.frame() in one call.
+    The window is the most recent `last` workouts, optionally restricted
+    to the last `days` days before `today`. Either limit may be None.
+    Returns a dictionary with the window's count, totals, averages and
+    pace in seconds per km, the 500m split for worksheets in
+    aggregates.SPLIT_WORKSHEETS, and the all-time count and totals.
+    """
+    window = frame
+    if days is not None:
+        today = pd.Timestamp(today or datetime.date.today())
+        window = window[window["date"] > today - pd.Timedelta(days=days)]
+    if last is not None:
+        window = window.tail(last)
+
+    return summarise(
+        worksheet,
+        len(window),
+        int(window["seconds"].sum()),
+        float(window["km"].sum()),
+        int(window.loc[window["km"] > 0, "seconds"].sum()),
+        len(frame),
+        int(frame["seconds"].sum()),
+        float(frame["km"].sum()),
+    )
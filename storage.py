@@ -0,0 +1,818 @@
+import datetime
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from dotenv import load_dotenv
+
+import instrumentation
+from aggregates import RECENT_WORKOUTS, AggregateStore, WorkoutAggregate
+from scheduler import RequestFailed, RequestScheduler
+from workouts import Machine, WorkoutColumns
+
+# The three worksheets every user workbook contains,
+# and the headings written to the first row of each one.
+WORKSHEET_NAMES = [machine.worksheet for machine in Machine]
+WORKSHEET_HEADINGS = ["Date", "Duration", "Distance"]
+
+# Define OAuth 2.0 scopes
+SCOPE = [
+    "https://www.googleapis.com/auth/spreadsheets",
+    "https://www.googleapis.com/auth/drive.file",
+    "https://www.googleapis.com/auth/drive"
+]
+
+CREDENTIALS_SPREADSHEET_NAME = 'UnstoppableUT2 Username and Password Data Spreadsheet'
+
+logger = logging.getLogger(__name__)
+
+
+def workout_row(time_data, distance_data, date=None):
+    """
+    Build the [date, duration, distance] row written to a worksheet.
+    The date defaults to today and is written as dd-mm-yyyy.
+    """
+    date = date or datetime.datetime.now()
+    return [date.strftime("%d-%m-%Y"), time_data, distance_data]
+
+
+class StorageError(Exception):
+    """
+    Raised when a storage backend cannot complete a request,
+    e.g. because the Google API returned an error.
+    """
+
+
+class CredentialsIndex:
+    """
+    In-memory map of username -> (row number, stored password).
+    The map is rebuilt with load() once it is older than ttl seconds
+    or after invalidate() is called. load() returns the credential rows
+    in sheet order, so checking a username or a password between reloads
+    is a dictionary lookup instead of a spreadsheet request.
+    """
+
+    def __init__(self, load, ttl=60):
+        self.load = load
+        self.ttl = ttl
+        self._entries = None
+        self._loaded_at = 0
+        self._row_count = 0
+        self._lock = threading.Lock()
+
+    def _current(self):
+        with self._lock:
+            if self._entries is None or time.monotonic() - self._loaded_at > self.ttl:
+                entries = {}
+                rows = self.load()
+                for row_number, row in enumerate(rows, start=1):
+                    if row and row[0] and row[0] not in entries:
+                        password = row[1] if len(row) > 1 else ""
+                        entries[row[0]] = (row_number, password)
+                self._entries = entries
+                self._row_count = len(rows)
+                self._loaded_at = time.monotonic()
+            return self._entries
+
+    def __contains__(self, username):
+        return username in self._current()
+
+    def get(self, username):
+        """
+        Return (row number, stored password) for the username,
+        or None if it isn't registered.
+        """
+        return self._current().get(username)
+
+    def usernames(self):
+        """
+        Return every registered username, in sheet order,
+        leaving out the heading in row 1.
+        """
+        return [username for username, (row_number, _) in self._current().items() if row_number > 1]
+
+    def row_count(self):
+        """
+        Return how many rows the sheet had when the index was loaded,
+        plus any rows recorded with add() since.
+        """
+        self._current()
+        return self._row_count
+
+    def add(self, username, row_number, password):
+        """
+        Record a username that has just been registered.
+        """
+        with self._lock:
+            if self._entries is not None:
+                self._entries.setdefault(username, (row_number, password))
+                self._row_count = max(self._row_count, row_number)
+
+    def update(self, username, row_number, password):
+        """
+        Record a changed password.
+        """
+        with self._lock:
+            if self._entries is not None:
+                self._entries[username] = (row_number, password)
+
+    def invalidate(self):
+        """
+        Forget the cached credentials so the next check reloads them.
+        """
+        with self._lock:
+            self._entries = None
+
+
+class SpreadsheetRegistry:
+    """
+    Local JSON index of username -> spreadsheet ID, so a user's workbook
+    can be opened by key instead of by a Drive search on its title.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._ids = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._ids is None:
+            try:
+                with open(self.path) as index_file:
+                    self._ids = json.load(index_file)
+            except FileNotFoundError:
+                self._ids = {}
+        return self._ids
+
+    def get(self, username):
+        """
+        Return the user's spreadsheet ID, or None if it isn't known.
+        """
+        with self._lock:
+            return self._load().get(username)
+
+    def record(self, username, spreadsheet_id):
+        """
+        Store the user's spreadsheet ID, rewriting the file atomically.
+        """
+        with self._lock:
+            ids = self._load()
+            if ids.get(username) == spreadsheet_id:
+                return
+            ids[username] = spreadsheet_id
+            temporary_path = f"{self.path}.tmp"
+            with open(temporary_path, "w") as index_file:
+                json.dump(ids, index_file)
+            os.replace(temporary_path, self.path)
+
+
+class Storage:
+    """
+    Interface shared by all storage backends.
+    Usernames and passwords live in one table and every user
+    has a workbook with one worksheet per workout type.
+    Workout rows are lists of strings - [date, duration, distance] -
+    exactly as they are written to the spreadsheet.
+    """
+
+    def __init__(self, aggregates=None):
+        # WorkoutColumns of each worksheet, keyed by (username, worksheet).
+        # Appended rows are parsed and added to them, so a worksheet is
+        # only read and parsed in full again when something else, such as
+        # another process, has changed its number of rows.
+        self._columns = {}
+        # Number of appends to each worksheet, so a read that raced an
+        # append isn't cached without the appended rows.
+        self._versions = {}
+        self._columns_lock = threading.Lock()
+        # Optional AggregateStore of running totals, updated on every
+        # append so stats don't have to read the whole worksheet.
+        self.aggregates = aggregates
+
+    def username_exists(self, username):
+        """
+        Return True if the username has already been registered.
+        """
+        raise NotImplementedError
+
+    def get_password(self, username):
+        """
+        Return the stored password for the username,
+        or None if the username doesn't exist.
+        """
+        raise NotImplementedError
+
+    def add_user(self, username, password):
+        """
+        Store a new username and password.
+        Return False without storing anything if the username
+        is already taken, including by a concurrent registration.
+        """
+        raise NotImplementedError
+
+    def update_password(self, username, password):
+        """
+        Replace the stored password of an existing user.
+        """
+        raise NotImplementedError
+
+    def usernames(self):
+        """
+        Return every registered username.
+        """
+        raise NotImplementedError
+
+    def user_workbook_exists(self, username):
+        """
+        Return True if the user already has a workout workbook.
+        """
+        raise NotImplementedError
+
+    def create_workbook(self, username):
+        """
+        Create the user's workbook with one worksheet per workout type.
+        """
+        raise NotImplementedError
+
+    def append_workout(self, username, worksheet, row):
+        """
+        Append one [date, duration, distance] row to a worksheet.
+        """
+        raise NotImplementedError
+
+    def append_workouts(self, username, worksheet, rows):
+        """
+        Append several [date, duration, distance] rows to a worksheet.
+        """
+        for row in rows:
+            self.append_workout(username, worksheet, row)
+
+    def get_workouts(self, username, worksheet):
+        """
+        Return every logged row of a worksheet, oldest first,
+        without the heading row.
+        """
+        raise NotImplementedError
+
+    def get_workouts_page(self, username, worksheet, start, count):
+        """
+        Return up to count logged rows of a worksheet, starting from
+        the row at index start (0 is the oldest workout).
+        """
+        return self.get_workouts(username, worksheet)[start:start + count]
+
+    def get_workout_columns(self, username, worksheet):
+        """
+        Return a worksheet as WorkoutColumns, fetching and parsing it
+        only if it isn't cached or the worksheet no longer holds as many
+        rows as the cache. The result is a copy that later appends don't change.
+        """
+        key = (username, worksheet)
+        with self._columns_lock:
+            columns = self._columns.get(key)
+            columns = None if columns is None else columns.copy()
+            version = self._versions.get(key, 0)
+        # Other processes and people editing the sheet add rows too.
+        if columns is not None and self.has_row_count(username, worksheet, len(columns)):
+            return columns
+        columns = WorkoutColumns.from_rows(self.get_workouts(username, worksheet), Machine.from_worksheet(worksheet))
+        with self._columns_lock:
+            if self._versions.get(key, 0) == version:
+                self._columns[key] = columns.copy()
+        return columns
+
+    def get_workouts_frame(self, username, worksheet):
+        """
+        Return a worksheet as a typed DataFrame (see WorkoutColumns.frame),
+        fetching it only if it isn't already cached.
+        """
+        return self.get_workout_columns(username, worksheet).frame()
+
+    def get_workout_stats(self, username, worksheet, last=3):
+        """
+        Return stats.workout_stats for the `last` most recent workouts.
+        With an aggregate store this reads the worksheet only the first
+        time, and answers from the running totals after that, as long
+        as the worksheet still holds as many rows as they cover.
+        """
+        if self.aggregates is None or last is None or not 0 <= last <= RECENT_WORKOUTS:
+            from stats import workout_stats
+
+            return workout_stats(self.get_workouts_frame(username, worksheet), worksheet, last=last)
+        return self._query_aggregate(username, worksheet, lambda aggregate: aggregate.stats(worksheet, last))
+
+    def get_workout_trends(self, username, worksheet, period="month", since=None):
+        """
+        Return a worksheet's totals, mean and best pace and longest
+        distance for each "week" or "month" from the date since,
+        and its personal records (see WorkoutAggregate.trends).
+        """
+        return self._query_aggregate(
+            username, worksheet, lambda aggregate: aggregate.trends(worksheet, period, since), [period]
+        )
+
+    def _query_aggregate(self, username, worksheet, query, periods=()):
+        """
+        Return query(aggregate) for the worksheet's WorkoutAggregate,
+        loaded with the rollups of the given period types, building it
+        from the full history if it isn't stored yet or no longer covers
+        as many rows as the worksheet holds.
+        """
+        if self.aggregates is not None:
+            aggregate = self.aggregates.get(username, worksheet, periods)
+            if aggregate is not None and self.has_row_count(username, worksheet, aggregate.count):
+                return query(aggregate)
+            version = self.aggregates.version(username, worksheet)
+        rows = self.get_workouts(username, worksheet)
+        aggregate = WorkoutAggregate.from_columns(WorkoutColumns.from_rows(rows, Machine.from_worksheet(worksheet)))
+        result = query(aggregate)
+        if self.aggregates is not None:
+            self.aggregates.seed(username, worksheet, aggregate, version)
+        return result
+
+    def has_row_count(self, username, worksheet, count):
+        """
+        Return True if a worksheet holds exactly count rows. Only the rows
+        either side of the last expected one are read, so this catches
+        rows added or removed by other processes or by hand cheaply.
+        """
+        if count == 0:
+            return not self.get_workouts_page(username, worksheet, 0, 1)
+        return len(self.get_workouts_page(username, worksheet, count - 1, 2)) == 1
+
+    def workout_count(self, username, worksheet):
+        """
+        Return how many rows a worksheet holds. With an aggregate store
+        this is its stored count, checked with has_row_count.
+        """
+        if self.aggregates is not None:
+            return self._query_aggregate(username, worksheet, lambda aggregate: aggregate.count)
+        return len(self.get_workouts(username, worksheet))
+
+    def invalidate_workouts(self, username, worksheet):
+        """
+        Drop the cached columns of a worksheet after it changes.
+        """
+        with self._columns_lock:
+            self._columns.pop((username, worksheet), None)
+            self._versions[(username, worksheet)] = self._versions.get((username, worksheet), 0) + 1
+
+    def workouts_appended(self, username, worksheet, rows):
+        """
+        Called by backends after appending rows to a worksheet.
+        """
+        key = (username, worksheet)
+        appended = WorkoutColumns.from_rows(rows, Machine.from_worksheet(worksheet))
+        with self._columns_lock:
+            self._versions[key] = self._versions.get(key, 0) + 1
+            columns = self._columns.get(key)
+            if columns is not None:
+                columns.extend(appended)
+        if self.aggregates is not None:
+            self.aggregates.record(username, worksheet, appended)
+
+
+@instrumentation.instrument_methods
+class SheetsStorage(Storage):
+    """
+    Storage backed by Google Sheets through gspread.
+    Each user gets a '{username} UT2 Tracker Spreadsheet' workbook and
+    credentials live in the first worksheet of the credentials spreadsheet.
+    """
+
+    def __init__(self, creds_file="creds.json", share_with=None, client=None, credentials=None,
+                 aggregates=None, drive_service=None):
+        super().__init__(aggregates)
+        self.creds_file = creds_file
+        self.share_with = share_with
+        # Every request to Google goes through the scheduler, which keeps
+        # within quota, retries rate limited requests and coalesces reads.
+        self.scheduler = RequestScheduler.from_environment()
+        self._client = self._scheduled(client) if client is not None else None
+        # Spreadsheet IDs are kept in a local index so workbooks can be
+        # opened by key, and handles are reused for the whole session.
+        self.registry = SpreadsheetRegistry(os.getenv("UT2_SPREADSHEET_INDEX", "spreadsheet_ids.json"))
+        self._workbooks = {}
+        self._worksheets = {}
+        self._drive_service = drive_service
+        self._credentials = credentials
+        self._credentials_sheet = None
+        self._lock = threading.RLock()
+        self._registration_lock = threading.Lock()
+        # Number of HTTP requests made to Google so far.
+        self.api_calls = 0
+        self._api_calls_lock = threading.Lock()
+        # Usernames and passwords are read with a single range request
+        # and cached for UT2_USERNAME_CACHE_TTL seconds, so retyping a
+        # username and then checking the password needs at most one read.
+        self.credentials_index = CredentialsIndex(
+            lambda: self.credentials_sheet.get('A:B'),
+            ttl=float(os.getenv("UT2_USERNAME_CACHE_TTL", "60"))
+        )
+
+    # Nothing below touches the disk or the network until it is
+    # first needed, so building a SheetsStorage is instant.
+    @property
+    def credentials(self):
+        """
+        Service account credentials, loaded from creds_file on first use.
+        """
+        with self._lock:
+            if self._credentials is None:
+                from google.oauth2.service_account import Credentials
+
+                self._credentials = Credentials.from_service_account_file(self.creds_file)
+        return self._credentials
+
+    @property
+    def client(self):
+        """
+        gspread client, authorized on first use.
+        """
+        if self._client is None:
+            credentials = self.credentials
+            with self._lock:
+                if self._client is None:
+                    import gspread
+                    from requests.adapters import HTTPAdapter
+
+                    client = gspread.authorize(credentials.with_scopes(SCOPE))
+                    client.session.hooks["response"].append(self._count_api_call)
+                    # Keep enough connections open for every thread sharing this client.
+                    pool_size = int(os.getenv("UT2_HTTP_POOL_SIZE", "32"))
+                    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+                    client.session.mount("https://", adapter)
+                    self._client = self._scheduled(client)
+        return self._client
+
+    def _scheduled(self, client):
+        # Clients without a request method, such as test doubles,
+        # are used as they are.
+        if hasattr(client, "request"):
+            self.scheduler.wrap_client(client)
+            # Timed outside the scheduler, so waiting for quota counts too.
+            instrumentation.wrap_client(client)
+        return client
+
+    def _count_api_call(self, *args, **kwargs):
+        with self._api_calls_lock:
+            self.api_calls += 1
+
+    @property
+    def credentials_sheet(self):
+        """
+        Worksheet holding usernames and passwords, opened on first use.
+        """
+        if self._credentials_sheet is None:
+            client = self.client
+            with self._lock:
+                if self._credentials_sheet is None:
+                    self._credentials_sheet = client.open(CREDENTIALS_SPREADSHEET_NAME).sheet1
+        return self._credentials_sheet
+
+    def workbook_name(self, username):
+        return f'{username} UT2 Tracker Spreadsheet'
+
+    def username_exists(self, username):
+        return username in self.credentials_index
+
+    def get_password(self, username):
+        entry = self.credentials_index.get(username)
+        if entry is None:
+            return None
+        return entry[1]
+
+    def add_user(self, username, password):
+        # Sheets has no conditional write, so registration appends first
+        # and then checks the rows added by anyone else since the index
+        # was loaded. The earliest row for a username wins. A losing row
+        # only has its password cleared, so no row numbers change and the
+        # index, which keeps the first row per username, ignores it.
+        with self._registration_lock:
+            if username in self.credentials_index:
+                return False
+            known_rows = self.credentials_index.row_count()
+            response = self.credentials_sheet.append_row([username, password], table_range='A1')
+            updated_range = response['updates']['updatedRange']
+            row_number = int(re.search(r'(\d+)(?::|$)', updated_range.split('!')[-1]).group(1))
+            if row_number > known_rows + 1:
+                appended_since = self.credentials_sheet.get(f'A{known_rows + 1}:A{row_number - 1}')
+                if [username] in appended_since:
+                    self.credentials_sheet.batch_clear([f'B{row_number}'])
+                    self.credentials_index.invalidate()
+                    return False
+            self.credentials_index.add(username, row_number, password)
+            return True
+
+    def usernames(self):
+        return self.credentials_index.usernames()
+
+    def update_password(self, username, password):
+        entry = self.credentials_index.get(username)
+        if entry is None:
+            raise StorageError(f"{username} isn't registered")
+        row_number = entry[0]
+        self.credentials_sheet.update(f'B{row_number}', [[password]])
+        self.credentials_index.update(username, row_number, password)
+
+    @property
+    def drive_service(self):
+        """
+        Drive API client, built once and reused.
+        """
+        with self._lock:
+            if self._drive_service is None:
+                from googleapiclient.discovery import build
+
+                self._drive_service = build('drive', 'v3', credentials=self.credentials)
+        return self._drive_service
+
+    def open_workbook(self, username):
+        """
+        Return the user's Spreadsheet, opened by key when its ID is in
+        the registry and by title (a Drive search) otherwise.
+        The handle is cached for the rest of the session.
+        """
+        with self._lock:
+            workbook = self._workbooks.get(username)
+        if workbook is None:
+            spreadsheet_id = self.registry.get(username)
+            if spreadsheet_id:
+                workbook = self.client.open_by_key(spreadsheet_id)
+            else:
+                workbook = self.client.open(self.workbook_name(username))
+                self.registry.record(username, workbook.id)
+            with self._lock:
+                self._workbooks[username] = workbook
+        return workbook
+
+    def open_worksheet(self, username, worksheet):
+        """
+        Return a cached Worksheet handle from the user's workbook.
+        """
+        key = (username, worksheet)
+        with self._lock:
+            handle = self._worksheets.get(key)
+        if handle is None:
+            handle = self.open_workbook(username).worksheet(worksheet)
+            with self._lock:
+                self._worksheets[key] = handle
+        return handle
+
+    # This code block was taken almost directly from
+    # the documentation for Google's Drive API.
+    # You can find it here: https://developers.google.com/drive/api/guides/search-files
+    def user_workbook_exists(self, username):
+        from googleapiclient.errors import HttpError
+
+        if self.registry.get(username):
+            return True
+        try:
+            page_token = None
+            while True:
+                # pylint: disable=maybe-no-member
+                request = self.drive_service.files().list(q=f"name='{self.workbook_name(username)}'",
+                                                          spaces='drive',
+                                                          fields='nextPageToken,'
+                                                                 'files(id, name)',
+                                                          pageToken=page_token)
+                execute = instrumentation.timed("google drive GET /drive/v3/files")(request.execute)
+                response = self.scheduler.run("drive", execute)
+                self._count_api_call()
+                for file in response.get('files', []):
+                    if self.workbook_name(username) in file['name']:
+                        self.registry.record(username, file['id'])
+                        return True
+                page_token = response.get('nextPageToken', None)
+                if page_token is None:
+                    return False
+        except (HttpError, RequestFailed) as error:
+            raise StorageError(error) from error
+
+    def create_workbook(self, username):
+        # A workbook takes at most four requests: copying the template
+        # (or creating a blank workbook and laying it out with one
+        # batch_update), plus sharing it with EMAIL_ADDRESS.
+        api_calls_before = self.api_calls
+        template_id = os.getenv("UT2_TEMPLATE_SPREADSHEET_ID")
+        if template_id:
+            user_workbook = self.client.copy(template_id, title=self.workbook_name(username))
+        else:
+            user_workbook = self.client.create(self.workbook_name(username))
+            user_workbook.batch_update({"requests": workbook_layout_requests()})
+        self.registry.record(username, user_workbook.id)
+        with self._lock:
+            self._workbooks[username] = user_workbook
+        if self.share_with:
+            user_workbook.share(self.share_with, perm_type='user', role='writer')
+        logger.info("Created workbook for %s with %d API calls",
+                    username, self.api_calls - api_calls_before)
+
+    def append_workout(self, username, worksheet, row):
+        self.open_worksheet(username, worksheet).append_row(row)
+        self.workouts_appended(username, worksheet, [row])
+
+    def append_workouts(self, username, worksheet, rows):
+        self.open_worksheet(username, worksheet).append_rows(rows)
+        self.workouts_appended(username, worksheet, rows)
+
+    def get_workouts(self, username, worksheet):
+        return self.open_worksheet(username, worksheet).get_all_values()[1:]
+
+    def get_workouts_page(self, username, worksheet, start, count):
+        # Row 1 holds the headings, so workout index 0 is on row 2.
+        first_row = start + 2
+        rows = self.open_worksheet(username, worksheet).get(f'A{first_row}:C{first_row + count - 1}')
+        # Unlike get_all_values, get leaves empty trailing cells out
+        # of a row, so a blank row comes back as [].
+        return [row + [""] * (3 - len(row)) for row in rows]
+
+
+def workbook_layout_requests():
+    """
+    Sheets API requests that turn a new workbook's default sheet
+    (which always has sheetId 0) into the three workout worksheets,
+    each 1000 rows by 3 columns with bold headings in the first row.
+    """
+    requests = []
+    for sheet_id, worksheet_name in enumerate(WORKSHEET_NAMES):
+        properties = {
+            "sheetId": sheet_id,
+            "title": worksheet_name,
+            "gridProperties": {"rowCount": 1000, "columnCount": 3}
+        }
+        if sheet_id == 0:
+            requests.append({"updateSheetProperties": {
+                "properties": properties,
+                "fields": "title,gridProperties.rowCount,gridProperties.columnCount"
+            }})
+        else:
+            requests.append({"addSheet": {"properties": properties}})
+    for sheet_id in range(len(WORKSHEET_NAMES)):
+        requests.append({"updateCells": {
+            "start": {"sheetId": sheet_id, "rowIndex": 0, "columnIndex": 0},
+            "rows": [{"values": [
+                {
+                    "userEnteredValue": {"stringValue": heading},
+                    "userEnteredFormat": {"textFormat": {"bold": True}}
+                }
+                for heading in WORKSHEET_HEADINGS
+            ]}],
+            "fields": "userEnteredValue,userEnteredFormat.textFormat.bold"
+        }})
+    return requests
+
+
+@instrumentation.instrument_methods
+class SQLiteStorage(Storage):
+    """
+    Local storage in a single SQLite file.
+    Useful for development, benchmarking and running
+    without Google credentials or a network connection.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS users (
+            username TEXT PRIMARY KEY,
+            password TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS workbooks (
+            username TEXT PRIMARY KEY
+        );
+        CREATE TABLE IF NOT EXISTS workouts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT NOT NULL,
+            machine TEXT NOT NULL,
+            date TEXT NOT NULL,
+            duration TEXT NOT NULL,
+            distance TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS workouts_by_user_and_machine
+            ON workouts (username, machine, id);
+    """
+
+    def __init__(self, path='unstoppable_ut2.db', aggregates=None):
+        super().__init__(aggregates)
+        self.path = path
+        # One connection shared between threads, serialised by a lock.
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.connection:
+            if path != ':memory:':
+                self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.executescript(self.SCHEMA)
+
+    def username_exists(self, username):
+        return self.get_password(username) is not None
+
+    def get_password(self, username):
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT password FROM users WHERE username = ?', (username,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def add_user(self, username, password):
+        with self.lock, self.connection:
+            cursor = self.connection.execute(
+                'INSERT OR IGNORE INTO users (username, password) VALUES (?, ?)', (username, password)
+            )
+        return cursor.rowcount == 1
+
+    def update_password(self, username, password):
+        with self.lock, self.connection:
+            self.connection.execute(
+                'UPDATE users SET password = ? WHERE username = ?', (password, username)
+            )
+
+    def usernames(self):
+        with self.lock:
+            rows = self.connection.execute('SELECT username FROM users ORDER BY username').fetchall()
+        return [row[0] for row in rows]
+
+    def user_workbook_exists(self, username):
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT 1 FROM workbooks WHERE username = ?', (username,)
+            ).fetchone()
+        return row is not None
+
+    def create_workbook(self, username):
+        with self.lock, self.connection:
+            self.connection.execute(
+                'INSERT OR IGNORE INTO workbooks (username) VALUES (?)', (username,)
+            )
+
+    def append_workout(self, username, worksheet, row):
+        with self.lock, self.connection:
+            self.connection.execute(
+                'INSERT INTO workouts (username, machine, date, duration, distance) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (username, worksheet, *row)
+            )
+        self.workouts_appended(username, worksheet, [row])
+
+    def append_workouts(self, username, worksheet, rows):
+        with self.lock, self.connection:
+            self.connection.executemany(
+                'INSERT INTO workouts (username, machine, date, duration, distance) '
+                'VALUES (?, ?, ?, ?, ?)',
+                [(username, worksheet, *row) for row in rows]
+            )
+        self.workouts_appended(username, worksheet, rows)
+
+    def get_workouts(self, username, worksheet):
+        with self.lock:
+            rows = self.connection.execute(
+                'SELECT date, duration, distance FROM workouts '
+                'WHERE username = ? AND machine = ? ORDER BY id',
+                (username, worksheet)
+            ).fetchall()
+        return [list(row) for row in rows]
+
+    def get_workouts_page(self, username, worksheet, start, count):
+        with self.lock:
+            rows = self.connection.execute(
+                'SELECT date, duration, distance FROM workouts '
+                'WHERE username = ? AND machine = ? ORDER BY id LIMIT ? OFFSET ?',
+                (username, worksheet, count, start)
+            ).fetchall()
+        return [list(row) for row in rows]
+
+    def workout_count(self, username, worksheet):
+        with self.lock:
+            return self.connection.execute(
+                'SELECT COUNT(*) FROM workouts WHERE username = ? AND machine = ?',
+                (username, worksheet)
+            ).fetchone()[0]
+
+
+def get_storage(backend=None, email_address=None):
+    """
+    Build the storage backend named by the UT2_STORAGE_BACKEND
+    environment variable - "sheets" (the default) or "sqlite".
+    The SQLite file location can be set with UT2_SQLITE_PATH.
+    Running totals for stats are kept in UT2_AGGREGATES_PATH.
+    Settings may also come from a .env file, and new workbooks are
+    shared with EMAIL_ADDRESS unless email_address is given, so every
+    entry point builds the same storage.
+    Backends connect lazily, so this never does network I/O.
+    """
+    load_dotenv()
+    email_address = email_address or os.getenv("EMAIL_ADDRESS")
+    backend = backend or os.getenv("UT2_STORAGE_BACKEND", "sheets")
+    if backend == "sheets":
+        aggregates = AggregateStore(os.getenv("UT2_AGGREGATES_PATH", "workout_aggregates.db"))
+        return SheetsStorage("creds.json", share_with=email_address, aggregates=aggregates)
+    if backend == "sqlite":
+        path = os.getenv("UT2_SQLITE_PATH", "unstoppable_ut2.db")
+        # Each database gets its own totals, so switching files can't mix them up.
+        aggregates = None
+        if path != ":memory:":
+            aggregates = AggregateStore(os.getenv("UT2_AGGREGATES_PATH", f"{path}.aggregates.db"))
+        return SQLiteStorage(path, aggregates=aggregates)
+    raise ValueError(f"Unknown storage backend: {backend}")
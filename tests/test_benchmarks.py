@@ -0,0 +1,63 @@
+"""
+The scenarios of benchmarks.suite as pytest-benchmark tests, run against
+the in-memory fake Google Sheets and Drive backend.
+
+Each test times one scenario on a backend already holding `size` users,
+workbooks and rows of history, and records the Google API requests per
+operation in the benchmark's extra_info. Sizes, latency and the share of
+rate limited requests can be set with UT2_BENCHMARK_SIZES (default
+"10 1000"), UT2_BENCHMARK_LATENCY and UT2_BENCHMARK_ERROR_RATE:
+
+    UT2_BENCHMARK_SIZES="10 1000 100000" python -m pytest tests/test_benchmarks.py
+
+The tests are skipped when pytest-benchmark isn't installed.
+"""
+import itertools
+import os
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+from benchmarks.suite import SCENARIOS, build_storage  # noqa: E402
+
+SIZES = [int(size) for size in os.getenv("UT2_BENCHMARK_SIZES", "10 1000").split()]
+FAKE = SimpleNamespace(
+    latency=float(os.getenv("UT2_BENCHMARK_LATENCY", "0")),
+    error_rate=float(os.getenv("UT2_BENCHMARK_ERROR_RATE", "0")),
+    retry_delay=0.01,
+)
+# Operations timed per scenario, as in benchmarks.suite.
+OPERATIONS = 20
+# Scenarios timed only once the running totals have been built.
+STEADY_STATE = ["averages", "trends"]
+
+
+@pytest.mark.parametrize("size", SIZES)
+@pytest.mark.parametrize("name, operation, operations", SCENARIOS, ids=[name for name, _, _ in SCENARIOS])
+def test_scenario(benchmark, name, operation, operations, size):
+    # Scenarios with a fixed number of operations, e.g. "averages first",
+    # time the first query on a backend, so each round gets a new one.
+    fresh_backend = operations is not None
+    builds = itertools.count()
+    numbers = itertools.count()
+    backend = {}
+    requests_made = []
+
+    def setup():
+        if fresh_backend or not backend:
+            backend["storage"], backend["requests"] = build_storage(size, FAKE, f"{name}-{next(builds)}")
+            if name in STEADY_STATE:
+                operation(backend["storage"], size, 0)
+        return (next(numbers),), {}
+
+    def run(number):
+        before = backend["requests"].total
+        operation(backend["storage"], size, number)
+        requests_made.append(backend["requests"].total - before)
+
+    benchmark.pedantic(run, setup=setup, rounds=3 if fresh_backend else OPERATIONS)
+    benchmark.extra_info["size"] = size
+    benchmark.extra_info["requests_per_operation"] = sum(requests_made) / len(requests_made)
+    benchmark.extra_info["retries"] = backend["storage"].scheduler.metrics().get("retries", 0)
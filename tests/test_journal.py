@@ -0,0 +1,188 @@
+import json
+import os
+import tempfile
+import unittest
+
+from journal import WorkoutJournal, journal_path
+from storage import SQLiteStorage, StorageError
+
+ROW = ["01-01-2024", "01:00:00", "12.50"]
+OTHER_ROW = ["01-01-2024", "00:30:00", "06.00"]
+
+
+class FailingStorage(SQLiteStorage):
+    """
+    Storage whose reads fail, like Google during an outage.
+    """
+
+    def get_workouts(self, username, worksheet):
+        raise OSError("storage unreachable")
+
+    def get_workouts_page(self, username, worksheet, start, count):
+        raise OSError("storage unreachable")
+
+
+class GoneUserStorage(SQLiteStorage):
+    """
+    Storage that refuses every append for the user "gone".
+    """
+
+    def append_workouts(self, username, worksheet, rows):
+        if username == "gone":
+            raise OSError("worksheet not found")
+        super().append_workouts(username, worksheet, rows)
+
+
+class WorkoutJournalTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "workout_journal.jsonl")
+        self.storage = SQLiteStorage(":memory:")
+        self.storage.add_user("someuser", "x")
+        self.storage.create_workbook("someuser")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def open_journal(self, storage=None):
+        return WorkoutJournal(self.path, storage or self.storage, flush_interval=60)
+
+    def kill(self, journal):
+        """
+        Stop a journal the way kill -9 would, without delivering anything.
+        """
+        journal._file.close()
+        journal._lock_file.close()
+
+    def write_journal(self, records):
+        with open(self.path, "w") as journal_file:
+            for record in records:
+                journal_file.write(json.dumps(record) + "\n")
+
+    def workouts(self):
+        return self.storage.get_workouts("someuser", "Treadmill")
+
+    def write_in_doubt(self, row_count, row=ROW):
+        entry = {"type": "workout", "key": "a", "username": "someuser", "worksheet": "Treadmill", "row": row}
+        sending = {"type": "sending", "keys": ["a"], "username": "someuser", "worksheet": "Treadmill",
+                   "row_count": row_count}
+        self.write_journal([entry, sending])
+
+    def test_live_processes_get_their_own_journals(self):
+        first = self.open_journal()
+        first.log("someuser", "Treadmill", ROW)
+        second = self.open_journal()
+        self.assertNotEqual(first.path, second.path)
+        self.assertEqual(second.pending_count(), 0)
+        # The first journal's file wasn't compacted away underneath it.
+        first.log("someuser", "Treadmill", ROW)
+        self.assertEqual(first.flush(), 2)
+        self.assertEqual(second.flush(), 0)
+        self.assertEqual(len(self.workouts()), 2)
+        first.stop()
+        second.stop()
+
+    def test_killed_process_journal_is_replayed_by_the_next_process(self):
+        first = self.open_journal()
+        first.log("someuser", "Treadmill", ROW)
+        self.kill(first)
+        second = self.open_journal()
+        self.assertEqual(second.path, self.path)
+        self.assertEqual(second.pending_count(), 1)
+        self.assertEqual(second.flush(), 1)
+        self.assertEqual(self.workouts(), [ROW])
+        second.stop()
+
+    def test_orphaned_journals_are_taken_over(self):
+        first = self.open_journal()
+        second = self.open_journal()
+        third = self.open_journal()
+        self.assertEqual(third.path, journal_path(self.path, 2))
+        third.log("someuser", "Treadmill", ROW)
+        self.kill(second)
+        self.kill(third)
+        fourth = self.open_journal()
+        self.assertEqual(fourth.path, journal_path(self.path, 1))
+        self.assertEqual(fourth.pending_count(), 1)
+        self.assertFalse(os.path.exists(third.path))
+        self.assertEqual(fourth.flush(), 1)
+        self.assertEqual(first.flush(), 0)
+        self.assertEqual(self.workouts(), [ROW])
+        first.stop()
+        fourth.stop()
+
+    def test_in_doubt_workouts_already_delivered_are_not_sent_again(self):
+        self.write_in_doubt(row_count=0)
+        self.storage.append_workout("someuser", "Treadmill", ROW)
+        journal = self.open_journal()
+        self.assertEqual(journal.flush(), 0)
+        self.assertEqual(journal.pending_count(), 0)
+        self.assertEqual(self.workouts(), [ROW])
+        journal.stop()
+
+    def test_in_doubt_workouts_never_delivered_are_sent(self):
+        self.write_in_doubt(row_count=0)
+        journal = self.open_journal()
+        self.assertEqual(journal.flush(), 1)
+        self.assertEqual(self.workouts(), [ROW])
+        journal.stop()
+
+    def test_same_workout_logged_twice_in_a_day_is_not_lost(self):
+        self.storage.append_workout("someuser", "Treadmill", ROW)
+        self.write_in_doubt(row_count=1)
+        journal = self.open_journal()
+        self.assertEqual(journal.flush(), 1)
+        self.assertEqual(journal.pending_count(), 0)
+        self.assertEqual(self.workouts(), [ROW, ROW])
+        journal.stop()
+
+    def test_delivered_workouts_followed_by_other_writers_are_not_sent_again(self):
+        self.write_in_doubt(row_count=0)
+        self.storage.append_workout("someuser", "Treadmill", ROW)
+        self.storage.append_workout("someuser", "Treadmill", OTHER_ROW)
+        journal = self.open_journal()
+        self.assertEqual(journal.flush(), 0)
+        self.assertEqual(journal.pending_count(), 0)
+        self.assertEqual(self.workouts(), [ROW, OTHER_ROW])
+        journal.stop()
+
+    def test_failing_user_does_not_hold_up_the_others(self):
+        storage = GoneUserStorage(":memory:")
+        journal = self.open_journal(storage)
+        journal.log("gone", "Treadmill", ROW)
+        journal.log("someuser", "Treadmill", ROW)
+        with self.assertRaises(StorageError):
+            journal.flush()
+        self.assertEqual(storage.get_workouts("someuser", "Treadmill"), [ROW])
+        self.assertEqual(journal.pending_count(), 1)
+        # The failed append is in doubt, checked and found not to have arrived.
+        with self.assertRaises(StorageError):
+            journal.flush()
+        self.assertEqual(journal.pending_count(), 1)
+        journal.stop()
+
+    def test_delivered_workouts_are_not_replayed(self):
+        entry = {"type": "workout", "key": "a", "username": "someuser", "worksheet": "Treadmill", "row": ROW}
+        self.write_journal([entry, {"type": "sending", "keys": ["a"]}, {"type": "delivered", "keys": ["a"]}])
+        journal = self.open_journal()
+        self.assertEqual(journal.pending_count(), 0)
+        journal.stop()
+
+    def test_unreachable_storage_does_not_stop_the_journal_opening(self):
+        entry = {"type": "workout", "key": "a", "username": "someuser", "worksheet": "Treadmill", "row": ROW}
+        self.write_journal([entry, {"type": "sending", "keys": ["a"], "username": "someuser",
+                                    "worksheet": "Treadmill", "row_count": 0}])
+        journal = self.open_journal(FailingStorage(":memory:"))
+        self.assertEqual(journal.pending_count(), 1)
+        with self.assertRaises(StorageError):
+            journal.flush()
+        self.kill(journal)
+        # The workout is still in doubt for the next run.
+        journal = self.open_journal()
+        self.assertEqual(journal.flush(), 1)
+        self.assertEqual(self.workouts(), [ROW])
+        journal.stop()
+
+
+if __name__ == "__main__":
+    unittest.main()
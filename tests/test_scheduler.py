@@ -0,0 +1,122 @@
+import threading
+import unittest
+from types import SimpleNamespace
+
+from scheduler import RequestFailed, RequestScheduler
+
+SHEET = "https://sheets.googleapis.com/v4/spreadsheets/abc/values/Treadmill"
+
+
+class APIError(Exception):
+    """
+    Error carrying an HTTP status like gspread's APIError.
+    """
+
+    def __init__(self, status):
+        super().__init__(f"HTTP {status}")
+        self.response = SimpleNamespace(status_code=status)
+
+
+class FakeClient:
+    """
+    Client whose requests fail with the given statuses, then succeed.
+    """
+
+    def __init__(self, statuses=()):
+        self.statuses = list(statuses)
+        self.calls = 0
+
+    def request(self, method, endpoint, *args, **kwargs):
+        self.calls += 1
+        if self.statuses:
+            raise APIError(self.statuses.pop(0))
+        return "ok"
+
+
+def scheduler(max_retries=5):
+    quotas = {"read": 1e9, "write": 1e9, "drive": 1e9}
+    return RequestScheduler(quotas, max_retries=max_retries, sleep=lambda delay: None)
+
+
+class RetryPolicyTest(unittest.TestCase):
+    def test_get_is_retried_on_server_errors(self):
+        client = scheduler().wrap_client(FakeClient([500, 503]))
+        self.assertEqual(client.request("get", SHEET), "ok")
+        self.assertEqual(client.calls, 3)
+
+    def test_post_is_retried_when_rate_limited(self):
+        client = scheduler().wrap_client(FakeClient([429, 429]))
+        self.assertEqual(client.request("post", SHEET), "ok")
+        self.assertEqual(client.calls, 3)
+
+    def test_post_is_not_retried_on_server_errors(self):
+        client = scheduler().wrap_client(FakeClient([503]))
+        with self.assertRaises(APIError):
+            client.request("post", SHEET)
+        self.assertEqual(client.calls, 1)
+
+    def test_other_errors_are_not_retried(self):
+        client = scheduler().wrap_client(FakeClient([404]))
+        with self.assertRaises(APIError):
+            client.request("get", SHEET)
+        self.assertEqual(client.calls, 1)
+
+    def test_request_failed_is_chained_to_the_last_error(self):
+        request_scheduler = scheduler(max_retries=2)
+        client = request_scheduler.wrap_client(FakeClient([429, 429, 429]))
+        with self.assertRaises(RequestFailed) as raised:
+            client.request("get", SHEET)
+        self.assertIsInstance(raised.exception.__cause__, APIError)
+        self.assertEqual(client.calls, 3)
+        self.assertEqual(request_scheduler.metrics()["failures"], 1)
+
+
+class BlockingClient:
+    """
+    Client whose first GET waits until released, so another
+    request can be made while it is in flight.
+    """
+
+    def __init__(self):
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.gets = 0
+
+    def request(self, method, endpoint, *args, **kwargs):
+        if method == "get":
+            self.gets += 1
+            if self.gets == 1:
+                self.started.set()
+                self.release.wait(5)
+        return method
+
+
+class CoalescingTest(unittest.TestCase):
+    def read_while_first_read_in_flight(self, between):
+        client = scheduler().wrap_client(BlockingClient())
+        first = threading.Thread(target=client.request, args=("get", SHEET))
+        first.start()
+        client.started.wait(5)
+        between(client)
+        second = threading.Thread(target=client.request, args=("get", SHEET))
+        second.start()
+        # Give the second read time to join the first if it is going to.
+        second.join(0.2)
+        client.release.set()
+        first.join()
+        second.join()
+        return client.gets
+
+    def test_identical_reads_in_flight_are_coalesced(self):
+        self.assertEqual(self.read_while_first_read_in_flight(lambda client: None), 1)
+
+    def test_read_after_a_write_does_not_join_an_older_read(self):
+        self.assertEqual(self.read_while_first_read_in_flight(lambda client: client.request("post", SHEET)), 2)
+
+    def test_writes_to_other_spreadsheets_do_not_stop_coalescing(self):
+        other = SHEET.replace("abc", "xyz")
+        self.assertEqual(self.read_while_first_read_in_flight(lambda client: client.request("post", other)), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,62 @@
+"""
+Checks and parsers for everything a user types in.
+
+The patterns are compiled once when the module is imported. Nothing
+here raises or prompts: the is_valid_ functions return a bool and the
+parse_ functions return the typed value, or None if the text is invalid,
+so the same rules serve the interactive prompts, bulk imports and the API.
+"""
+import re
+from decimal import Decimal
+
+# Usernames and passwords are at least five lowercase letters.
+CREDENTIAL_FORMAT = re.compile(r'[a-z]{5,}')
+
+# Workout durations are entered as hh:mm:ss, less than 24 hours.
+DURATION_FORMAT = re.compile(r'([01]\d|2[0-3]):([0-5]\d):([0-5]\d)')
+# Workout distances are entered in kilometres as 00.00.
+DISTANCE_FORMAT = re.compile(r'\d\d\.\d\d')
+
+# Looking up each pair of digits is quicker than calling int() on it.
+TWO_DIGITS = {f"{number:02d}": number for number in range(60)}
+
+
+def is_valid_duration(time_data):
+    """
+    Return True if time_data is a workout duration in the 00:00:00 format.
+    """
+    return DURATION_FORMAT.fullmatch(time_data) is not None
+
+
+def is_valid_distance(distance_data):
+    """
+    Return True if distance_data is a distance in the 00.00 format.
+    """
+    return DISTANCE_FORMAT.fullmatch(str(distance_data)) is not None
+
+
+def is_valid_credential(text):
+    """
+    Return True if text is a valid username or password.
+    """
+    return CREDENTIAL_FORMAT.fullmatch(text) is not None
+
+
+def parse_duration(time_data):
+    """
+    Return a 00:00:00 duration as whole seconds, or None if it isn't valid.
+    """
+    if DURATION_FORMAT.fullmatch(time_data) is None:
+        return None
+    return TWO_DIGITS[time_data[:2]] * 3600 + TWO_DIGITS[time_data[3:5]] * 60 + TWO_DIGITS[time_data[6:]]
+
+
+def parse_distance(distance_data):
+    """
+    Return a 00.00 distance as a Decimal number of kilometres,
+    or None if it isn't valid.
+    """
+    distance_data = str(distance_data)
+    if DISTANCE_FORMAT.fullmatch(distance_data) is None:
+        return None
+    return Decimal(distance_data)